@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Depends
+from tables import User, engine, async_engine, pool_options
+from func import auth_current_user, role_checker
+
+admin_router = APIRouter()
+
+@admin_router.get("/db-pool")
+async def db_pool_stats(user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    return {
+        "config": pool_options,
+        "sync": engine.pool.metrics(),
+        "async": async_engine.pool.metrics(),
+    }
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import warnings
+from typing import AsyncIterator, Iterable, Optional, Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+from dotenv import load_dotenv
+
+load_dotenv()
+AVATAR_DIR = os.getenv("AMS_AVATAR_DIR", "media/avatars")
+AVATAR_MAX_BYTES = int(os.getenv("AMS_AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+AVATAR_THUMBNAIL_SIZE = int(os.getenv("AMS_AVATAR_THUMBNAIL_SIZE", "128"))
+# A few KB of compressed pixels can decode to gigabytes, so the dimensions are capped before decoding
+AVATAR_MAX_PIXELS = int(os.getenv("AMS_AVATAR_MAX_PIXELS", str(24 * 1000 * 1000)))
+
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+THUMBNAIL_CONTENT_TYPE = "image/jpeg"
+
+class AvatarError(ValueError):
+    """Raised for an upload that is too large or isn't a supported image."""
+
+class AvatarTooLarge(AvatarError):
+    pass
+
+class FilesystemAvatarStore:
+    """Keeps each member's picture and its thumbnail as files under root, named by user id.
+    The database row only holds the ETag (a content hash) and the content type."""
+
+    def __init__(
+        self, root: str = AVATAR_DIR, max_bytes: int = AVATAR_MAX_BYTES, thumbnail_size: int = AVATAR_THUMBNAIL_SIZE,
+        max_pixels: int = AVATAR_MAX_PIXELS,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.max_pixels = max_pixels
+
+    def path(self, user_id: int, thumbnail: bool = False) -> str:
+        return os.path.join(self.root, f"{user_id}.thumb" if thumbnail else f"{user_id}.original")
+
+    def _temp_file(self):
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.root, suffix=".upload", delete=False)
+
+    async def save(self, user_id: int, chunks: AsyncIterator[bytes]) -> Tuple[str, str]:
+        """Streams an upload to disk, then verifies it and builds the thumbnail off the event loop."""
+        digest = hashlib.sha256()
+        size = 0
+        upload = self._temp_file()
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise AvatarTooLarge(f"Image is larger than {self.max_bytes} bytes")
+                digest.update(chunk)
+                await asyncio.to_thread(upload.write, chunk)
+            upload.close()
+            if not size:
+                raise AvatarError("Empty upload")
+            return await asyncio.to_thread(self._commit, user_id, upload.name, digest.hexdigest())
+        finally:
+            upload.close()
+            if os.path.exists(upload.name):
+                os.remove(upload.name)
+
+    def store_bytes(self, user_id: int, data: bytes) -> Tuple[str, str]:
+        """Synchronous variant for scripts and migrations that already hold the image bytes."""
+        with self._temp_file() as upload:
+            upload.write(data)
+        try:
+            return self._commit(user_id, upload.name, hashlib.sha256(data).hexdigest())
+        finally:
+            if os.path.exists(upload.name):
+                os.remove(upload.name)
+
+    def _commit(self, user_id: int, upload_path: str, etag: str) -> Tuple[str, str]:
+        try:
+            with warnings.catch_warnings():
+                # Pillow only warns between its own limit and twice that; both are refused here
+                warnings.simplefilter("error", Image.DecompressionBombWarning)
+                with Image.open(upload_path) as image:
+                    # Opening reads only the header, so the size is known before any pixel is decoded
+                    width, height = image.size
+                    if width * height > self.max_pixels:
+                        raise AvatarTooLarge(f"Image is larger than {self.max_pixels} pixels")
+                    image.verify()
+                # verify() leaves the image unusable, so it is opened again for the thumbnail
+                with Image.open(upload_path) as image:
+                    content_type = Image.MIME.get(image.format)
+                    if content_type not in ALLOWED_CONTENT_TYPES:
+                        raise AvatarError("Unsupported image type, use JPEG, PNG, GIF or WebP")
+                    thumbnail = ImageOps.exif_transpose(image).convert("RGB")
+                    thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+            raise AvatarTooLarge("Image has too many pixels") from e
+        except (UnidentifiedImageError, OSError, SyntaxError) as e:
+            raise AvatarError("Upload is not a valid image") from e
+
+        with self._temp_file() as thumbnail_file:
+            thumbnail.save(thumbnail_file, format="JPEG", quality=85)
+        # Renames within one directory are atomic, so readers see either the old or the new picture
+        os.replace(thumbnail_file.name, self.path(user_id, thumbnail=True))
+        os.replace(upload_path, self.path(user_id))
+        return etag, content_type
+
+    def delete(self, user_id: int) -> None:
+        self.delete_many([user_id])
+
+    def delete_many(self, user_ids: Iterable[int]) -> None:
+        for user_id in user_ids:
+            for thumbnail in (False, True):
+                try:
+                    os.remove(self.path(user_id, thumbnail))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+avatar_store = FilesystemAvatarStore()
+
+def etag_header(etag: str, thumbnail: bool = False) -> str:
+    return f'"{etag}-thumb"' if thumbnail else f'"{etag}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return etag in (candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates)
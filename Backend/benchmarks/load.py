@@ -0,0 +1,228 @@
+"""End-to-end load test of the main API paths.
+
+Boots main.app in-process (httpx ASGITransport, lifespan included) against a throwaway
+SQLite database, or a local Postgres with --database-url, with the fake SMS transport and
+the in-memory event broker. The database is seeded with --members members (and their other
+dates, some falling today), then each scenario is driven for --requests requests at
+--concurrency and reported as throughput plus p50/p95/p99 latency. The outbox the send
+routes filled is finally drained through worker.deliver_batch and a FakeTransport.
+Only the first write_message/custom_message call queues anything; the delivery log turns
+the repeats into skips, so those scenarios mostly measure the idempotency check.
+
+    cd Backend && pip install -r requirements-dev.txt   # httpx and aiosqlite
+    cd Backend && python benchmarks/load.py --members 5000 --requests 200 --output load.json
+    cd Backend && python benchmarks/load.py --save-baseline benchmarks/baseline.json
+    cd Backend && python benchmarks/load.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+With --baseline the run exits with status 1 when any scenario's p95 latency rises, or its
+throughput drops, by more than --tolerance compared with the stored baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def configure_environment(args):
+    # Must run before the app modules are imported: they read their settings at import time
+    if args.database_url:
+        os.environ["AMS_DATABASE_URL"] = args.database_url
+        os.environ["AMS_ASYNC_DATABASE_URL"] = args.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="ams-bench-"), "bench.db")
+        os.environ["AMS_DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ["AMS_ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    os.environ["AMS_SMS_TRANSPORT"] = "fake"
+    os.environ["AMS_EVENTS_BACKEND"] = "memory"
+    os.environ["AMS_SEED_DUMMY_USER"] = "true"
+    # Scheduled sends would race the write_message scenario for the same delivery log keys
+    os.environ["AMS_SCHEDULER_ENABLED"] = "false"
+    # auth_login measures the login path itself, not how quickly the limiter says no
+    os.environ["AMS_LOGIN_RATE_LIMIT"] = "false"
+    os.environ["AMS_BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("ALGORITHM", "HS256")
+
+def seed(members: int):
+    from sqlalchemy import insert, update
+    from tables import Base, Local_Session, User, Dates, month_day_key, engine
+    from schemas import StatusEnum
+    from hashing import pwd_context
+
+    Base.metadata.create_all(engine)
+    today = date.today()
+    password = pwd_context.hash("benchmark-password")
+    rng = random.Random(42)
+    users, dates = [], []
+    for i in range(members):
+        # About 1 in 20 members has a birthday, anniversary or other event today
+        dob = today.replace(year=1990) if i % 20 == 0 else date(1990, rng.randint(1, 12), rng.randint(1, 28))
+        users.append({
+            "first_name": f"Member{i}", "last_name": "Bench", "phone_number": f"+1555{i:07d}",
+            "username": f"bench{i}", "password": password, "dob": dob, "dob_month_day": month_day_key(dob),
+            "role": "user", "status": StatusEnum.active if i % 2 else StatusEnum.pending, "date": datetime.now(),
+        })
+    with Local_Session() as db:
+        ids = db.scalars(insert(User).returning(User.id), users).all()
+        for i, user_id in enumerate(ids):
+            for label in ("anniversary", "graduation"):
+                event_date = today.replace(year=2015) if i % 20 == 1 else date(2015, rng.randint(1, 12), rng.randint(1, 28))
+                dates.append({"user_id": user_id, "label": label, "date": event_date, "month_day": month_day_key(event_date)})
+        db.execute(insert(Dates), dates)
+        db.commit()
+    pending_ids = [user_id for i, user_id in enumerate(ids) if i % 2 == 0]
+
+    def reset_pending():
+        with Local_Session() as db:
+            db.execute(update(User).where(User.id.in_(pending_ids)).values(status=StatusEnum.pending))
+            db.commit()
+
+    return reset_pending
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def summarize(name: str, latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+async def drive(name: str, send, requests: int, concurrency: int, before_each=None) -> dict:
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            if before_each:
+                # Untimed reset so every request does the same amount of work
+                await asyncio.to_thread(before_each)
+            started = time.perf_counter()
+            response = await send()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    # Resets are excluded from throughput as well as from the latencies
+    elapsed = sum(latencies) if before_each else time.perf_counter() - started
+    return summarize(name, latencies, errors, elapsed)
+
+async def drain_outbox(transport_latency: float, concurrency: int) -> dict:
+    from dispatch import Dispatcher, FakeTransport
+    from worker import deliver_batch
+
+    dispatcher = Dispatcher(FakeTransport(latency=transport_latency), concurrency=concurrency, rate_per_second=0)
+    delivered = 0
+    started = time.perf_counter()
+    while True:
+        batch = await deliver_batch(dispatcher)
+        if not batch:
+            break
+        delivered += batch
+    elapsed = time.perf_counter() - started
+    return {"scenario": "outbox_delivery", "messages": delivered, "throughput_mps": round(delivered / elapsed, 1) if elapsed else 0.0}
+
+async def run(args) -> dict:
+    import httpx
+    import main
+    from schemas import DummyUser
+
+    reset_pending = seed(args.members)
+    admin = DummyUser()
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        login = await client.post("/user/auth-login", data={"username": admin.username, "password": admin.password})
+        login.raise_for_status()
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        scenarios = [
+            ("auth_login", lambda: client.post("/user/auth-login", data={"username": "bench1", "password": "benchmark-password"}), None),
+            ("retrieve_members_details", lambda: client.get("/user/retrieve-members-details", params={"limit": 100}, headers=headers), None),
+            ("activate_all", lambda: client.post("/user/new-members/activate-all", headers=headers), reset_pending),
+            ("write_message", lambda: client.post("/message/write-message", params={"event_type": "birthday"}, headers=headers), None),
+            ("custom_message", lambda: client.post("/message/custom-message", json={"event_type": "others", "message": "Benchmark message"}, headers=headers), None),
+        ]
+        results = []
+        for name, send, before_each in scenarios:
+            if args.only and name not in args.only:
+                continue
+            # Requests that reset state between calls are driven one at a time
+            concurrency = 1 if before_each else args.concurrency
+            results.append(await drive(name, send, args.requests, concurrency, before_each))
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    delivery = await drain_outbox(args.transport_latency, args.concurrency)
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "database": os.environ["AMS_DATABASE_URL"].split(":", 1)[0],
+        "members": args.members,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "scenarios": results,
+        "delivery": delivery,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    previous = {scenario["scenario"]: scenario for scenario in baseline.get("scenarios", [])}
+    for scenario in report["scenarios"]:
+        before = previous.get(scenario["scenario"])
+        if not before:
+            continue
+        if scenario["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{scenario['scenario']}: p95 {scenario['p95_ms']} ms vs baseline {before['p95_ms']} ms")
+        if scenario["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{scenario['scenario']}: {scenario['throughput_rps']} req/s vs baseline {before['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL of a local Postgres (defaults to a temporary SQLite file)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="keeps auth_login from measuring bcrypt alone")
+    parser.add_argument("--transport-latency", type=float, default=0.0, help="simulated SMS provider latency in seconds")
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="fail when the run regresses against this report")
+    parser.add_argument("--save-baseline", help="write the JSON report here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    configure_environment(args)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as output:
+            output.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as stored:
+            regressions = compare(report, json.load(stored), args.tolerance)
+        if regressions:
+            print("Regressions against " + args.baseline + ":\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
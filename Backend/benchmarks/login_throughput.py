@@ -0,0 +1,70 @@
+"""Login hashing throughput, before and after moving bcrypt off the event loop.
+
+"inline" verifies on the event loop the way auth_user used to; "pool" goes through
+hashing.password_hasher. Both runs fire CONCURRENCY simultaneous logins for the given
+duration and report logins/second and the worst event-loop stall seen by a 10 ms ticker,
+which is the latency every other request on the worker would have suffered.
+
+    cd Backend && python benchmarks/login_throughput.py --seconds 5 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashing import PasswordHasher, pwd_context  # noqa: E402
+
+async def heartbeat(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(0.01)
+        lags.append(loop.time() - started - 0.01)
+
+async def run(mode: str, seconds: float, concurrency: int, hashed: str, hasher: PasswordHasher):
+    stop = asyncio.Event()
+    lags: list = []
+    done = 0
+
+    async def login():
+        nonlocal done
+        while not stop.is_set():
+            if mode == "inline":
+                pwd_context.verify("benchmark-password", hashed)
+            else:
+                await hasher.verify_and_update("benchmark-password", hashed)
+            done += 1
+            await asyncio.sleep(0)
+
+    ticker = asyncio.create_task(heartbeat(stop, lags))
+    clients = [asyncio.create_task(login()) for _ in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*clients, ticker)
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "logins_per_second": round(done / elapsed, 1),
+        "max_loop_stall_ms": round(max(lags, default=0) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    hashed = pwd_context.hash("benchmark-password")
+    hasher = PasswordHasher(workers=args.workers, queue_size=args.concurrency, timeout=60)
+    results = [asyncio.run(run(mode, args.seconds, args.concurrency, hashed, hasher)) for mode in ("inline", "pool")]
+    hasher.shutdown()
+    print(json.dumps({"cpu_count": os.cpu_count(), "bcrypt_rounds": pwd_context.handler("bcrypt").default_rounds, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Cold-start cost of a worker: importing main, running the lifespan startup and serving a first request.
+
+Each run is a fresh interpreter, as a new uvicorn worker or autoscaled pod would be. It runs
+against a temporary SQLite database whose schema is created up front, with the fake SMS
+transport and in-memory event broker. --seed-dummy-user turns AMS_SEED_DUMMY_USER on to show
+what seeding on every boot costs.
+
+    cd Backend && pip install -r requirements-dev.txt   # httpx and aiosqlite
+    cd Backend && python benchmarks/startup.py --runs 10
+    cd Backend && python benchmarks/startup.py --runs 10 --seed-dummy-user --bcrypt-rounds 12
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of timings in milliseconds
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {backend_dir!r})
+import main
+imported = time.perf_counter()
+
+async def boot():
+    import httpx
+    async with main.lifespan(main.app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            (await client.get("/metrics")).raise_for_status()
+        return ready, time.perf_counter()
+
+ready, first_response = asyncio.run(boot())
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "lifespan_ms": (ready - imported) * 1000,
+    "first_request_ms": (first_response - ready) * 1000,
+    "total_ms": (first_response - started) * 1000,
+}}))
+"""
+
+def environment(args, database: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "AMS_DATABASE_URL": f"sqlite:///{database}",
+        "AMS_ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{database}",
+        "AMS_SMS_TRANSPORT": "fake",
+        "AMS_EVENTS_BACKEND": "memory",
+        "AMS_SEED_DUMMY_USER": "true" if args.seed_dummy_user else "false",
+        "AMS_BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+    })
+    env.setdefault("SECRET_KEY", "benchmark-secret-key")
+    env.setdefault("ALGORITHM", "HS256")
+    return env
+
+def create_schema(env: dict):
+    # Schema creation is a deploy step (manage.py migrate), so it stays out of the measured boot
+    script = f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import tables; tables.Base.metadata.create_all(tables.engine)"
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed-dummy-user", action="store_true")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="ams-startup-"), "startup.db")
+    env = environment(args, database)
+    create_schema(env)
+
+    runs = []
+    for _ in range(args.runs):
+        child = subprocess.run([sys.executable, "-c", CHILD.format(backend_dir=BACKEND_DIR)], env=env, check=True, capture_output=True, text=True)
+        runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    phases = ("import_ms", "lifespan_ms", "first_request_ms", "total_ms")
+    report = {
+        "runs": args.runs,
+        "seed_dummy_user": args.seed_dummy_user,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "median": {phase: round(statistics.median(run[phase] for run in runs), 1) for phase in phases},
+        "min": {phase: round(min(run[phase] for run in runs), 1) for phase in phases},
+        "max": {phase: round(max(run[phase] for run in runs), 1) for phase in phases},
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
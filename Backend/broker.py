@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable
+import asyncpg
+from sqlalchemy import text
+from dotenv import load_dotenv
+from tables import async_engine, db_url
+
+load_dotenv()
+EVENTS_BACKEND = os.getenv("AMS_EVENTS_BACKEND", "postgres")
+EVENTS_CHANNEL = os.getenv("AMS_EVENTS_CHANNEL", "ams_events")
+EVENTS_RECONNECT_DELAY = float(os.getenv("AMS_EVENTS_RECONNECT_DELAY", "2"))
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD = 7999
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str], Awaitable[None]]
+
+def event_message(event_type: str, data: dict) -> str:
+    return json.dumps({"type": event_type, "data": data, "at": datetime.now().isoformat()}, default=str)
+
+class InMemoryBroker:
+    """Single-process backend: published events go straight to this worker's clients (tests, one worker)."""
+
+    def __init__(self) -> None:
+        self._deliver = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, message: str) -> None:
+        if self._deliver is not None:
+            await self._deliver(message)
+
+    async def stop(self) -> None:
+        pass
+
+class PostgresBroker:
+    """Relays events through LISTEN/NOTIFY so every uvicorn worker and pod delivers each one to its own clients once."""
+
+    def __init__(self, dsn: str, channel: str = EVENTS_CHANNEL) -> None:
+        self.dsn = dsn
+        self.channel = channel
+        self._listener = None
+        self._stopping = False
+        self._reconnect_task = None
+        self._deliveries: set = set()
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        self._stopping = False
+        await self._listen()
+
+    async def _listen(self) -> None:
+        self._listener = await asyncpg.connect(self.dsn)
+        self._listener.add_termination_listener(self._on_terminated)
+        await self._listener.add_listener(self.channel, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        delivery = asyncio.get_running_loop().create_task(self._deliver(payload))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+
+    def _on_terminated(self, connection) -> None:
+        if not self._stopping:
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+            try:
+                await self._listen()
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Event listener reconnect failed: %s", e)
+
+    async def publish(self, message: str) -> None:
+        if len(message.encode()) > MAX_NOTIFY_PAYLOAD:
+            logger.warning("Dropping event larger than the NOTIFY payload limit (%d bytes)", len(message.encode()))
+            return
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": message})
+            await conn.commit()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+
+def notify(db, event_type: str, data: dict) -> None:
+    """Queues an event on a sync session (worker.py); Postgres sends it when that transaction commits."""
+    message = event_message(event_type, data)
+    if EVENTS_BACKEND != "postgres" or len(message.encode()) > MAX_NOTIFY_PAYLOAD:
+        return
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": message})
+
+def build_broker(channel: str = EVENTS_CHANNEL):
+    if EVENTS_BACKEND == "memory":
+        return InMemoryBroker()
+    return PostgresBroker(db_url, channel)
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from sqlalchemy import Integer, String, DateTime, column, func as sql_func, or_, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from tables import Async_Local_Session, OutboundMessage
+from metrics import Histogram, LATENCY_BUCKETS, request_metrics
+from dispatch import SMS_RATE_PER_SECOND
+from worker import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL
+
+load_dotenv()
+# Signatures are only skipped for local testing against fake providers
+CALLBACK_VERIFY = os.getenv("AMS_CALLBACK_VERIFY", "true").lower() in ("1", "true", "yes")
+# Public base URL the providers call (e.g. https://api.example.com) when the app sits behind a proxy;
+# Twilio signs the exact URL it requested
+CALLBACK_BASE_URL = os.getenv("AMS_CALLBACK_BASE_URL")
+SENDGRID_WEBHOOK_PUBLIC_KEY = os.getenv("AMS_SENDGRID_WEBHOOK_PUBLIC_KEY")
+CALLBACK_FLUSH_SIZE = int(os.getenv("AMS_CALLBACK_FLUSH_SIZE", "500"))
+CALLBACK_FLUSH_INTERVAL = float(os.getenv("AMS_CALLBACK_FLUSH_INTERVAL", "1"))
+# Beyond this many buffered updates callbacks get a 503, and the provider retries later
+CALLBACK_MAX_BUFFER = int(os.getenv("AMS_CALLBACK_MAX_BUFFER", "50000"))
+# A Twilio callback can arrive before the worker commits the message SID, which happens once the whole
+# claimed batch is sent, so unmatched updates are kept at least that long plus a poll interval
+CALLBACK_MATCH_WINDOW = float(os.getenv(
+    "AMS_CALLBACK_MATCH_WINDOW",
+    str((OUTBOX_BATCH_SIZE / SMS_RATE_PER_SECOND if SMS_RATE_PER_SECOND > 0 else 0) + OUTBOX_POLL_INTERVAL + 30),
+))
+
+# An update the database refuses this many times on its own (not as part of a failed batch) is dropped
+CALLBACK_MAX_ATTEMPTS = int(os.getenv("AMS_CALLBACK_MAX_ATTEMPTS", "5"))
+
+FLUSH_ROW_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Later statuses win when callbacks for one message arrive out of order or in the same flush
+STATUS_RANK = {
+    "queued": 0, "accepted": 0, "processed": 1, "sending": 1, "deferred": 1, "sent": 2,
+    "delivered": 3, "undelivered": 3, "failed": 3, "bounce": 3, "dropped": 3,
+}
+FINAL_STATUSES = tuple(name for name, rank in STATUS_RANK.items() if rank == 3)
+SENDGRID_DELIVERY_EVENTS = ("processed", "deferred", "delivered", "bounce", "dropped")
+
+logger = logging.getLogger("ams.callbacks")
+
+@dataclass
+class StatusUpdate:
+    status: str
+    error: Optional[str]
+    at: datetime
+    received_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+class StatusBuffer:
+    """Collects provider status updates in memory and writes them out in batches.
+
+    Updates are keyed by how they find their outbox row ("id" for SendGrid's custom_args,
+    "provider_id" for Twilio's MessageSid), so repeated callbacks for one message collapse into
+    one row of the next flush. A flush runs once flush_size updates are waiting or every
+    flush_interval seconds, as one multi-row UPDATE per key kind. When that UPDATE fails, the
+    kind is retried one update per SAVEPOINT, and an update refused max_attempts times is dropped.
+    """
+
+    def __init__(self, flush_size: int = CALLBACK_FLUSH_SIZE, flush_interval: float = CALLBACK_FLUSH_INTERVAL, max_size: int = CALLBACK_MAX_BUFFER, match_window: float = CALLBACK_MATCH_WINDOW, max_attempts: int = CALLBACK_MAX_ATTEMPTS) -> None:
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.match_window = match_window
+        self.max_attempts = max_attempts
+        self._pending: Dict[Tuple[str, str], StatusUpdate] = {}
+        self._flush_now: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._lock = asyncio.Lock()
+        self.received: Dict[str, int] = {}
+        self.rejected = 0
+        self.unmatched = 0
+        self.dead_lettered = 0
+        self.flush_latency = Histogram("ams_callback_flush_seconds", "Time to write one batch of provider status updates.", ("matched_by",), LATENCY_BUCKETS)
+        self.flush_rows = Histogram("ams_callback_flush_rows", "Status updates written per batch.", ("matched_by",), FLUSH_ROW_BUCKETS)
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def add(self, provider: str, matched_by: str, key: str, status_update: StatusUpdate) -> bool:
+        """Buffers one update; False when the buffer is full."""
+        current = self._pending.get((matched_by, key))
+        if current is None and len(self._pending) >= self.max_size:
+            self.rejected += 1
+            return False
+        self.received[provider] = self.received.get(provider, 0) + 1
+        if current is None or STATUS_RANK.get(status_update.status, 0) >= STATUS_RANK.get(current.status, 0):
+            self._pending[(matched_by, key)] = status_update
+        if len(self._pending) >= self.flush_size and self._flush_now is not None:
+            self._flush_now.set()
+        return True
+
+    async def flush(self) -> int:
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            by_kind: Dict[str, Dict[str, StatusUpdate]] = {}
+            for (matched_by, key), status_update in batch.items():
+                by_kind.setdefault(matched_by, {})[key] = status_update
+            written = 0
+            for matched_by, updates in by_kind.items():
+                started = time.perf_counter()
+                failed: Dict[str, StatusUpdate] = {}
+                try:
+                    async with Async_Local_Session() as db:
+                        matched = await apply_status_updates(db, matched_by, updates)
+                        await db.commit()
+                except Exception:
+                    logger.exception("Writing %d provider status updates failed; retrying them one at a time", len(updates))
+                    try:
+                        matched, failed = await self._apply_each(matched_by, updates)
+                    except Exception:
+                        # The database is unreachable rather than refusing particular rows, so nothing counts against them
+                        logger.exception("Writing provider status updates failed; they stay buffered")
+                        self._requeue(matched_by, updates)
+                        continue
+                    self._retry_or_drop(matched_by, failed)
+                else:
+                    self.flush_latency.observe((matched_by,), time.perf_counter() - started)
+                    self.flush_rows.observe((matched_by,), len(updates))
+                written += len(matched)
+                self._requeue(matched_by, {key: status_update for key, status_update in updates.items() if key not in matched and key not in failed}, unmatched=True)
+            return written
+
+    async def _apply_each(self, matched_by: str, updates: Dict[str, StatusUpdate]) -> Tuple[set, Dict[str, StatusUpdate]]:
+        """Matched keys and the updates the database refused, writing each update in its own SAVEPOINT."""
+        matched, failed = set(), {}
+        async with Async_Local_Session() as db:
+            # Connecting first, so an outage fails here instead of being blamed on the first update
+            await db.connection()
+            for key, status_update in updates.items():
+                try:
+                    async with db.begin_nested():
+                        matched |= await apply_status_updates(db, matched_by, {key: status_update})
+                except Exception:
+                    failed[key] = status_update
+            await db.commit()
+        return matched, failed
+
+    def _retry_or_drop(self, matched_by: str, failed: Dict[str, StatusUpdate]) -> None:
+        retry = {}
+        for key, status_update in failed.items():
+            status_update.attempts += 1
+            if status_update.attempts >= self.max_attempts:
+                self.dead_lettered += 1
+                logger.error("Dropping %s status update for %s=%s after %d failed writes", status_update.status, matched_by, key, status_update.attempts)
+            else:
+                retry[key] = status_update
+        self._requeue(matched_by, retry)
+
+    def _requeue(self, matched_by: str, updates: Dict[str, StatusUpdate], unmatched: bool = False) -> None:
+        now = time.monotonic()
+        for key, status_update in updates.items():
+            if unmatched and now - status_update.received_at > self.match_window:
+                self.unmatched += 1
+                continue
+            # A newer callback that arrived during the flush takes precedence
+            current = self._pending.get((matched_by, key))
+            if current is None or STATUS_RANK.get(status_update.status, 0) > STATUS_RANK.get(current.status, 0):
+                self._pending[(matched_by, key)] = status_update
+
+    async def run(self) -> None:
+        self._flush_now = asyncio.Event()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        # The loop is let finish its current flush rather than cancelled, so no swapped-out batch is lost
+        if self._task:
+            self._stopping = True
+            if self._flush_now is not None:
+                self._flush_now.set()
+            await self._task
+            self._task = None
+        # Whatever is still buffered is written before the process exits
+        await self.flush()
+
+    def render_metrics(self) -> List[str]:
+        lines = [
+            "# HELP ams_callback_buffer_depth Provider status updates waiting to be written.",
+            "# TYPE ams_callback_buffer_depth gauge",
+            f"ams_callback_buffer_depth {self.depth}",
+            "# HELP ams_callback_received_total Provider status callbacks accepted into the buffer.",
+            "# TYPE ams_callback_received_total counter",
+        ]
+        lines.extend(f'ams_callback_received_total{{provider="{provider}"}} {count}' for provider, count in sorted(self.received.items()))
+        lines.extend([
+            "# HELP ams_callback_rejected_total Callbacks turned away because the buffer was full.",
+            "# TYPE ams_callback_rejected_total counter",
+            f"ams_callback_rejected_total {self.rejected}",
+            "# HELP ams_callback_unmatched_total Status updates dropped after matching no outbox row.",
+            "# TYPE ams_callback_unmatched_total counter",
+            f"ams_callback_unmatched_total {self.unmatched}",
+            "# HELP ams_callback_dead_lettered_total Status updates dropped after the database refused them repeatedly.",
+            "# TYPE ams_callback_dead_lettered_total counter",
+            f"ams_callback_dead_lettered_total {self.dead_lettered}",
+        ])
+        lines.extend(self.flush_latency.render())
+        lines.extend(self.flush_rows.render())
+        return lines
+
+async def apply_status_updates(db: AsyncSession, matched_by: str, updates: Dict[str, StatusUpdate]) -> set:
+    """Writes updates to their outbox rows and returns the keys that matched a row."""
+    key_column = OutboundMessage.id if matched_by == "id" else OutboundMessage.provider_id
+    rows = [(int(key) if matched_by == "id" else key, status_update.status, status_update.error, status_update.at) for key, status_update in updates.items()]
+    # A final status is never replaced by an in-flight one that arrived late
+    not_final = sql_func.coalesce(OutboundMessage.provider_status, "").notin_(FINAL_STATUSES)
+
+    if db.get_bind().dialect.name == "postgresql":
+        incoming = values(
+            column("key", Integer if matched_by == "id" else String),
+            column("status", String), column("error", String), column("at", DateTime),
+            name="incoming",
+        ).data(rows)
+        statement = (
+            update(OutboundMessage)
+            .where(key_column == incoming.c.key)
+            .where(or_(not_final, incoming.c.status.in_(FINAL_STATUSES)))
+            .values(provider_status=incoming.c.status, provider_error=incoming.c.error, provider_status_at=incoming.c.at)
+            .returning(key_column)
+        )
+        return {str(key) for key in (await db.scalars(statement)).all()}
+
+    # SQLite (local runs) has no UPDATE ... FROM (VALUES ...) with column names, so rows go one at a time
+    matched = set()
+    for key, status_name, error, at in rows:
+        statement = (
+            update(OutboundMessage)
+            .where(key_column == key)
+            .where(or_(not_final, status_name in FINAL_STATUSES))
+            .values(provider_status=status_name, provider_error=error, provider_status_at=at)
+            .returning(key_column)
+        )
+        matched.update(str(found) for found in (await db.scalars(statement)).all())
+    return matched
+
+status_buffer = StatusBuffer()
+request_metrics.register(status_buffer.render_metrics)
+
+def callback_url(request: Request) -> str:
+    if CALLBACK_BASE_URL:
+        query = f"?{request.url.query}" if request.url.query else ""
+        return CALLBACK_BASE_URL.rstrip("/") + request.url.path + query
+    return str(request.url)
+
+def verify_twilio(request: Request, params: dict) -> bool:
+    from twilio.request_validator import RequestValidator
+
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if not auth_token:
+        raise HTTPException(status_code=503, detail="Twilio auth token not set in environment")
+    return RequestValidator(auth_token).validate(callback_url(request), params, request.headers.get("X-Twilio-Signature", ""))
+
+def verify_sendgrid(request: Request, payload: bytes) -> bool:
+    from sendgrid.helpers.eventwebhook import EventWebhook, EventWebhookHeader
+
+    if not SENDGRID_WEBHOOK_PUBLIC_KEY:
+        raise HTTPException(status_code=503, detail="SendGrid webhook public key not set in environment")
+    signature = request.headers.get(EventWebhookHeader.SIGNATURE)
+    timestamp = request.headers.get(EventWebhookHeader.TIMESTAMP)
+    if not signature or not timestamp:
+        return False
+    try:
+        return EventWebhook(SENDGRID_WEBHOOK_PUBLIC_KEY).verify_signature(payload.decode(), signature, timestamp)
+    except Exception:
+        return False
+
+def buffer_full():
+    # Twilio and SendGrid both retry a callback that doesn't get a 2xx
+    raise HTTPException(status_code=503, detail="Status buffer is full, retry later", headers={"Retry-After": "5"})
+
+callback_router = APIRouter()
+
+@callback_router.post("/twilio/status", status_code=status.HTTP_204_NO_CONTENT)
+async def twilio_status_callback(request: Request):
+    params = dict(await request.form())
+    if CALLBACK_VERIFY and not verify_twilio(request, params):
+        raise HTTPException(status_code=403, detail="Invalid Twilio signature")
+
+    sid = params.get("MessageSid")
+    message_status = params.get("MessageStatus")
+    if not sid or not message_status:
+        raise HTTPException(status_code=400, detail="MessageSid and MessageStatus are required")
+    status_update = StatusUpdate(status=message_status, error=params.get("ErrorCode") or None, at=datetime.now())
+    if not status_buffer.add("twilio", "provider_id", sid, status_update):
+        buffer_full()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@callback_router.post("/sendgrid/events", status_code=status.HTTP_204_NO_CONTENT)
+async def sendgrid_event_webhook(request: Request):
+    payload = await request.body()
+    if CALLBACK_VERIFY and not verify_sendgrid(request, payload):
+        raise HTTPException(status_code=403, detail="Invalid SendGrid signature")
+    try:
+        events = json.loads(payload)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+
+    for event in events:
+        # Engagement events (open, click, ...) don't change delivery state; outbox_id comes from custom_args
+        if not isinstance(event, dict) or event.get("event") not in SENDGRID_DELIVERY_EVENTS or not str(event.get("outbox_id", "")).isdigit():
+            continue
+        at = datetime.fromtimestamp(event["timestamp"]) if isinstance(event.get("timestamp"), (int, float)) else datetime.now()
+        error = (event.get("reason") or event.get("response")) if event["event"] in ("bounce", "dropped", "deferred") else None
+        status_update = StatusUpdate(status=event["event"], error=str(error)[:64] if error else None, at=at)
+        if not status_buffer.add("sendgrid", "id", str(event["outbox_id"]), status_update):
+            buffer_full()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
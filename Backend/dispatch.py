@@ -0,0 +1,288 @@
+import asyncio
+import os
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Protocol
+from dotenv import load_dotenv
+
+load_dotenv()
+SMS_CONCURRENCY = int(os.getenv("AMS_SMS_CONCURRENCY", "10"))
+SMS_RATE_PER_SECOND = float(os.getenv("AMS_SMS_RATE_PER_SECOND", "10"))
+SMS_MAX_RETRIES = int(os.getenv("AMS_SMS_MAX_RETRIES", "3"))
+SMS_RETRY_BACKOFF = float(os.getenv("AMS_SMS_RETRY_BACKOFF", "0.5"))
+SMS_TRANSPORT = os.getenv("AMS_SMS_TRANSPORT", "twilio")
+EMAIL_CONCURRENCY = int(os.getenv("AMS_EMAIL_CONCURRENCY", "2"))
+# Email limits count API calls, each carrying up to EMAIL_BATCH_SIZE recipients
+EMAIL_RATE_PER_SECOND = float(os.getenv("AMS_EMAIL_RATE_PER_SECOND", "5"))
+EMAIL_BATCH_SIZE = min(int(os.getenv("AMS_EMAIL_BATCH_SIZE", "1000")), 1000)
+EMAIL_MAX_RETRIES = int(os.getenv("AMS_EMAIL_MAX_RETRIES", "3"))
+EMAIL_RETRY_BACKOFF = float(os.getenv("AMS_EMAIL_RETRY_BACKOFF", "1"))
+EMAIL_TRANSPORT = os.getenv("AMS_EMAIL_TRANSPORT", "sendgrid")
+EMAIL_SUBJECT = os.getenv("AMS_EMAIL_SUBJECT", "A message for you")
+
+class TransientSendError(Exception):
+    """Provider failure that is worth retrying (throttling, 5xx, network)."""
+
+@dataclass
+class OutgoingMessage:
+    username: str
+    phone_number: Optional[str]
+    body: str
+    user_id: Optional[int] = None
+    label: Optional[str] = None
+    email: Optional[str] = None
+    # Member preference ("sms", "email" or "both") when queueing; set to the single channel once in the outbox
+    channels: str = "sms"
+    outbox_id: Optional[int] = None
+
+@dataclass
+class DeliveryResult:
+    username: str
+    address: str
+    status: str
+    attempts: int
+    provider_id: Optional[str] = None
+    error: Optional[str] = None
+
+class SmsTransport(Protocol):
+    async def send(self, to: str, body: str) -> str:
+        ...
+
+class TwilioTransport:
+    def __init__(self, client, from_number: str, status_callback: Optional[str] = None) -> None:
+        self.client = client
+        self.from_number = from_number
+        self.status_callback = status_callback
+
+    async def send(self, to: str, body: str) -> str:
+        from requests.exceptions import ConnectionError as ProviderConnectionError, Timeout as ProviderTimeout
+        from twilio.base.exceptions import TwilioRestException
+
+        # The Twilio client is blocking, so each call runs on a thread instead of the event loop
+        try:
+            options = {"status_callback": self.status_callback} if self.status_callback else {}
+            message = await asyncio.to_thread(self.client.messages.create, body=body, from_=self.from_number, to=to, **options)
+        except TwilioRestException as e:
+            if e.status == 429 or e.status >= 500:
+                raise TransientSendError(str(e)) from e
+            raise
+        except (ProviderConnectionError, ProviderTimeout) as e:
+            raise TransientSendError(str(e)) from e
+        return message.sid
+
+class FakeTransport:
+    """Stands in for Twilio in tests and benchmarks, optionally with latency and random transient failures."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent: list = []
+
+    async def send(self, to: str, body: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TransientSendError("Simulated provider failure")
+        self.sent.append((to, body))
+        return f"FAKE{len(self.sent):08d}"
+
+class EmailTransport(Protocol):
+    async def send_batch(self, messages: List[OutgoingMessage]) -> str:
+        ...
+
+class SendGridTransport:
+    """Sends a whole batch as one SendGrid request: one personalization per recipient, with the
+    message text substituted into a shared body and the outbox id carried in custom_args."""
+
+    def __init__(self, client, from_email: str, subject: str = EMAIL_SUBJECT) -> None:
+        self.client = client
+        self.from_email = from_email
+        self.subject = subject
+
+    def payload(self, messages: List[OutgoingMessage]) -> dict:
+        return {
+            "from": {"email": self.from_email},
+            "subject": self.subject,
+            "content": [{"type": "text/plain", "value": "-body-"}],
+            "personalizations": [
+                {
+                    "to": [{"email": message.email}],
+                    "substitutions": {"-body-": message.body},
+                    "custom_args": {"outbox_id": str(message.outbox_id)},
+                }
+                for message in messages
+            ],
+        }
+
+    async def send_batch(self, messages: List[OutgoingMessage]) -> str:
+        from python_http_client.exceptions import HTTPError
+        from requests.exceptions import ConnectionError as ProviderConnectionError, Timeout as ProviderTimeout
+
+        try:
+            response = await asyncio.to_thread(self.client.client.mail.send.post, request_body=self.payload(messages))
+        except HTTPError as e:
+            if e.status_code == 429 or e.status_code >= 500:
+                raise TransientSendError(str(e)) from e
+            raise
+        except (ProviderConnectionError, ProviderTimeout, OSError) as e:
+            raise TransientSendError(str(e)) from e
+        return response.headers.get("X-Message-Id", "")
+
+class FakeEmailTransport:
+    """Stands in for SendGrid in tests and benchmarks; records each batch instead of sending it."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.batches: list = []
+
+    async def send_batch(self, messages: List[OutgoingMessage]) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TransientSendError("Simulated provider failure")
+        self.batches.append([(message.email, message.body) for message in messages])
+        return f"FAKEMAIL{len(self.batches):08d}"
+
+class RateLimiter:
+    """Spaces sends evenly so no more than rate_per_second leave the process."""
+
+    def __init__(self, rate_per_second: float) -> None:
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+def backoff(base: float, attempts: int) -> float:
+    # Exponential, with jitter so retries from concurrent workers don't line up
+    return base * 2 ** (attempts - 1) * (1 + random.random())
+
+def build_sms_transport() -> SmsTransport:
+    if SMS_TRANSPORT == "fake":
+        return FakeTransport()
+
+    twilio_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    twilio_token = os.getenv("TWILIO_AUTH_TOKEN")
+    twilio_number = os.getenv("TWILIO_PHONE_NUMBER")
+    if not all([twilio_sid, twilio_token, twilio_number]):
+        raise RuntimeError("Twilio credentials not set in environment")
+    # The Twilio SDK is slow to import, so only processes that actually send pay for it
+    from twilio.rest import Client
+    # e.g. https://api.example.com/callbacks/twilio/status, so delivery receipts reach callbacks.py
+    return TwilioTransport(Client(twilio_sid, twilio_token), twilio_number, os.getenv("AMS_TWILIO_STATUS_CALLBACK_URL"))
+
+def build_email_transport() -> EmailTransport:
+    if EMAIL_TRANSPORT == "fake":
+        return FakeEmailTransport()
+
+    sendgrid_key = os.getenv("SENDGRID_API_KEY")
+    from_email = os.getenv("AMS_EMAIL_FROM")
+    if not all([sendgrid_key, from_email]):
+        raise RuntimeError("SendGrid API key or AMS_EMAIL_FROM not set in environment")
+    from sendgrid import SendGridAPIClient
+    return SendGridTransport(SendGridAPIClient(sendgrid_key), from_email)
+
+class Dispatcher:
+    def __init__(
+        self,
+        transport: SmsTransport,
+        concurrency: int = SMS_CONCURRENCY,
+        rate_per_second: float = SMS_RATE_PER_SECOND,
+        max_retries: int = SMS_MAX_RETRIES,
+        retry_backoff: float = SMS_RETRY_BACKOFF,
+    ) -> None:
+        self.transport = transport
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    async def send_all(self, messages: List[OutgoingMessage]) -> List[DeliveryResult]:
+        results: List[Optional[DeliveryResult]] = [None] * len(messages)
+        pending = iter(enumerate(messages))
+
+        async def worker():
+            for index, message in pending:
+                results[index] = await self._deliver(message)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(messages)))))
+        return results
+
+    async def _deliver(self, message: OutgoingMessage) -> DeliveryResult:
+        attempts = 0
+        while True:
+            attempts += 1
+            await self.rate_limiter.acquire()
+            try:
+                provider_id = await self.transport.send(message.phone_number, message.body)
+            except TransientSendError as e:
+                if attempts > self.max_retries:
+                    return DeliveryResult(message.username, message.phone_number, "failed", attempts, error=str(e))
+                await asyncio.sleep(backoff(self.retry_backoff, attempts))
+            except Exception as e:
+                return DeliveryResult(message.username, message.phone_number, "failed", attempts, error=str(e))
+            else:
+                return DeliveryResult(message.username, message.phone_number, "sent", attempts, provider_id=provider_id)
+
+class BatchDispatcher:
+    """Email counterpart of Dispatcher: recipients go out batch_size at a time, so the concurrency,
+    rate limit and retries apply to provider calls rather than to individual messages."""
+
+    def __init__(
+        self,
+        transport: EmailTransport,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        concurrency: int = EMAIL_CONCURRENCY,
+        rate_per_second: float = EMAIL_RATE_PER_SECOND,
+        max_retries: int = EMAIL_MAX_RETRIES,
+        retry_backoff: float = EMAIL_RETRY_BACKOFF,
+    ) -> None:
+        self.transport = transport
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    async def send_all(self, messages: List[OutgoingMessage]) -> List[DeliveryResult]:
+        batches = [messages[start:start + self.batch_size] for start in range(0, len(messages), self.batch_size)]
+        results: List[List[DeliveryResult]] = [[] for _ in batches]
+        pending = iter(enumerate(batches))
+
+        async def worker():
+            for index, batch in pending:
+                results[index] = await self._deliver(batch)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(batches)))))
+        return [result for batch_results in results for result in batch_results]
+
+    async def _deliver(self, batch: List[OutgoingMessage]) -> List[DeliveryResult]:
+        attempts = 0
+        while True:
+            attempts += 1
+            await self.rate_limiter.acquire()
+            try:
+                provider_id = await self.transport.send_batch(batch)
+            except TransientSendError as e:
+                if attempts > self.max_retries:
+                    return [DeliveryResult(message.username, message.email, "failed", attempts, error=str(e)) for message in batch]
+                await asyncio.sleep(backoff(self.retry_backoff, attempts))
+            except Exception as e:
+                return [DeliveryResult(message.username, message.email, "failed", attempts, error=str(e)) for message in batch]
+            else:
+                return [DeliveryResult(message.username, message.email, "sent", attempts, provider_id=provider_id) for message in batch]
+
+def build_dispatchers(channels) -> dict:
+    """One dispatcher per delivery channel, each with its own transport and limits."""
+    builders = {
+        "sms": lambda: Dispatcher(build_sms_transport()),
+        "email": lambda: BatchDispatcher(build_email_transport()),
+    }
+    return {channel: builders[channel]() for channel in channels}
@@ -0,0 +1,104 @@
+import asyncio
+import os
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+from dotenv import load_dotenv
+from tables import Async_Local_Session
+from func import get_token_user
+from broker import build_broker, event_message
+
+load_dotenv()
+WS_QUEUE_SIZE = int(os.getenv("AMS_WS_QUEUE_SIZE", "100"))
+WS_CLOSE_TIMEOUT = float(os.getenv("AMS_WS_CLOSE_TIMEOUT", "5"))
+
+events_router = APIRouter()
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int) -> None:
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = None
+
+class ConnectionManager:
+    """Fans events out to dashboard sockets; each socket has its own bounded queue and writer task,
+    so a slow client only ever delays itself and is evicted once its queue overflows.
+    Events are published through the broker, which hands them back to every worker's manager for local fan-out."""
+
+    def __init__(self, broker, queue_size: int = WS_QUEUE_SIZE) -> None:
+        self.broker = broker
+        self.queue_size = queue_size
+        self.active_connections: dict = {}
+        self._closing: set = set()
+
+    async def start(self):
+        await self.broker.start(self.broadcast)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = ClientConnection(websocket, self.queue_size)
+        client.writer = asyncio.create_task(self._write(client))
+        self.active_connections[websocket] = client
+
+    async def _write(self, client: ClientConnection):
+        try:
+            while True:
+                message = await client.queue.get()
+                await client.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone (closed, reset, or errored mid-send)
+            self.active_connections.pop(client.websocket, None)
+
+    async def broadcast(self, message: str):
+        for websocket, client in list(self.active_connections.items()):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._evict(websocket, code=status.WS_1013_TRY_AGAIN_LATER)
+
+    async def publish(self, event_type: str, data: dict):
+        await self.broker.publish(event_message(event_type, data))
+
+    def _evict(self, websocket: WebSocket, code: int):
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        client.writer.cancel()
+        closing = asyncio.create_task(self._close(websocket, code))
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), WS_CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    async def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(websocket, None)
+        if client is not None:
+            client.writer.cancel()
+
+connection_manager = ConnectionManager(build_broker())
+
+@events_router.websocket("/events")
+async def dashboard_events(websocket: WebSocket, token: str):
+    # Browsers can't set an Authorization header on a WebSocket, so the access token comes in the query string
+    async with Async_Local_Session() as db:
+        try:
+            user = await get_token_user(token, db)
+        except HTTPException:
+            user = None
+    if user is None or user.role != "admin":
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await connection_manager.connect(websocket)
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        await connection_manager.disconnect(websocket)
@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from enum import Enum
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+from tables import Async_Local_Session
+from schemas import FileFormat
+
+load_dotenv()
+EXPORT_CHUNK_SIZE = int(os.getenv("AMS_EXPORT_CHUNK_SIZE", "1000"))
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+async def _ndjson_chunks(partitions):
+    async for rows in partitions:
+        yield "".join(json.dumps({key: _plain(value) for key, value in row.items()}) + "\n" for row in rows)
+
+async def _csv_chunks(partitions, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in partitions:
+        for row in rows:
+            writer.writerow([_plain(row[column]) for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def stream_export(statement, export_format: FileFormat, filename: str) -> StreamingResponse:
+    """Streams a column select as NDJSON or CSV, reading it through a server-side cursor in fixed-size chunks."""
+    columns = [column.key for column in statement.selected_columns]
+
+    async def partitions():
+        # Own session: the request's session is closed before a streaming body is sent
+        async with Async_Local_Session() as db:
+            result = await db.stream(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            async for rows in result.mappings().partitions():
+                yield rows
+
+    if export_format == FileFormat.csv:
+        body, media_type = _csv_chunks(partitions(), columns), "text/csv"
+    else:
+        body, media_type = _ndjson_chunks(partitions()), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'})
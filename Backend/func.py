@@ -1,23 +1,36 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select, or_
+from datetime import date, datetime, timedelta
+from calendar import isleap
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import os
 import asyncio
+import hashlib
+from typing import Optional
 from dotenv import load_dotenv
-from schemas import TokenData, DummyUser, StatusEnum
-from tables import get_db, User, Dates
+from schemas import TokenData, DummyUser, StatusEnum, OutboxStatusEnum, ChannelPreference
+from sqlalchemy.dialects import postgresql, sqlite
+from tables import get_db, get_async_db, User, Dates, OutboundMessage, DeliveryLog, month_day_key
+from cache import TTLCache
+from hashing import pwd_context, password_hasher
+from invalidation import invalidation_bus
 
 load_dotenv()
 ALGORITHM = os.getenv("ALGORITHM")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+AUTH_CACHE_TTL = float(os.getenv("AMS_AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AMS_AUTH_CACHE_SIZE", "1024"))
+# Bulk changes naming more members than this tell the other workers to clear their whole principal cache
+PRINCIPAL_ANNOUNCE_LIMIT = 100
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/auth-login")
+# Detached User rows keyed by (lower-cased) token subject, so protected routes skip the lookup query
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
 def create_fake_user(user: DummyUser, db: Session = Depends(get_db)) -> User:
     existing_user = db.query(User).filter(User.username == user.username).all()
@@ -67,18 +80,161 @@ def create_refresh_token(data: dict, expires_delta: timedelta):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username.ilike(username)).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(User).where(User.username.ilike(username)))
 
-async def auth_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+def keyset_page(statement, id_column, after_id: Optional[int], limit: int):
+    # Seeks past the last id the client saw instead of OFFSET, so every page costs the same
+    if after_id is not None:
+        statement = statement.where(id_column > after_id)
+    return statement.order_by(id_column).limit(limit)
+
+def set_next_cursor(response: Response, rows: list, limit: int):
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+
+FEB_28, FEB_29 = 228, 229
+
+def month_day_keys(day: date) -> list:
+    # In a non-leap year, 29 February dates are celebrated on the 28th
+    if month_day_key(day) == FEB_28 and not isleap(day.year):
+        return [FEB_28, FEB_29]
+    return [month_day_key(day)]
+
+def month_day_ranges(start: date, end: date) -> list:
+    """Inclusive MMDD key ranges covering start..end; a window crossing New Year is split in two."""
+    if (end - start).days >= 365:
+        return [(101, 1231)]
+    if start.year == end.year:
+        ranges = [(month_day_key(start), month_day_key(end), end.year)]
+    else:
+        ranges = [(month_day_key(start), 1231, start.year), (101, month_day_key(end), end.year)]
+    return [(low, FEB_29 if high == FEB_28 and not isleap(year) else high) for low, high, year in ranges]
+
+def month_day_in(column, start: date, end: date):
+    return or_(*(column.between(low, high) for low, high in month_day_ranges(start, end)))
+
+def occurrence_between(original: date, start: date, end: date) -> Optional[date]:
+    """The anniversary of original that falls in start..end, if any."""
+    for year in range(start.year, end.year + 1):
+        if original.month == 2 and original.day == 29 and not isleap(year):
+            occurrence = date(year, 2, 28)
+        else:
+            occurrence = original.replace(year=year)
+        if start <= occurrence <= end:
+            return occurrence
+    return None
+
+def birthdays_on(day: date):
+    return select(User).where(User.dob_month_day.in_(month_day_keys(day)))
+
+def dates_on(day: date):
+    return select(Dates).where(Dates.month_day.in_(month_day_keys(day)))
+
+def delivery_key(event_type: str, label: Optional[str], user_id: int, send_date: date, body: Optional[str] = None) -> str:
+    # Automatic messages are once per occurrence; a custom message is once per occurrence and text
+    parts = ["custom" if body is not None else "auto", event_type, label or "", str(user_id), send_date.isoformat()]
+    if body is not None:
+        parts.append(body)
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def upsert_insert(db: AsyncSession, table):
+    # INSERT ... ON CONFLICT needs the dialect's own insert construct
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+def delivery_channels(message) -> list:
+    """Outbox channels for one message; email falls back to SMS for members without an address."""
+    if not message.email:
+        return ["sms"]
+    return ChannelPreference(message.channels).channels
+
+async def enqueue_messages(db: AsyncSession, messages: list, event_type: str, send_date: date, custom: bool = False) -> list:
+    """Logs and queues messages, skipping any recipient already served for this occurrence; returns the queued ones."""
+    if not messages:
+        return []
+    keyed = {
+        delivery_key(event_type, message.label, message.user_id, send_date, message.body if custom else None): message
+        for message in messages
+    }
+    # A single INSERT ... ON CONFLICT DO NOTHING both checks and claims every key: rows already in the
+    # log (from an earlier or concurrent send) are simply not returned
+    logged = (await db.execute(
+        upsert_insert(db, DeliveryLog).on_conflict_do_nothing(index_elements=["idempotency_key"]).returning(DeliveryLog.id, DeliveryLog.idempotency_key),
+        [
+            {
+                "idempotency_key": key,
+                "user_id": message.user_id,
+                "username": message.username,
+                "event_type": event_type,
+                "label": message.label or "",
+                "send_date": send_date,
+                "body": message.body,
+                "created_at": datetime.now(),
+            }
+            for key, message in keyed.items()
+        ],
+    )).all()
+    if not logged:
+        await db.rollback()
+        return []
+
+    # One multi-row INSERT into the outbox; worker.py picks the rows up and talks to the provider
+    log_ids = {row.idempotency_key: row.id for row in logged}
+    queued = [(log_ids[key], message) for key, message in keyed.items() if key in log_ids]
+    await db.execute(insert(OutboundMessage), [
+        {
+            "user_id": message.user_id,
+            "username": message.username,
+            "channel": channel,
+            "phone_number": message.phone_number if channel == "sms" else None,
+            "email": message.email if channel == "email" else None,
+            "body": message.body,
+            "event_type": event_type,
+            "status": OutboxStatusEnum.pending,
+            "attempts": 0,
+            "created_at": datetime.now(),
+            "delivery_log_id": log_id,
+        }
+        for log_id, message in queued
+        for channel in delivery_channels(message)
+    ])
+    await db.commit()
+    return [message for _, message in queued]
+
+async def auth_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
     return user
 
-async def auth_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def invalidate_principal(*usernames: str, announce: bool = True):
+    keys = [username.lower() for username in usernames if username]
+    for key in keys:
+        principal_cache.pop(key)
+    if announce and keys:
+        # A long list won't fit in one NOTIFY payload; dropping everything on the other workers is cheaper
+        if len(keys) > PRINCIPAL_ANNOUNCE_LIMIT:
+            invalidation_bus.announce("principals.clear")
+        else:
+            invalidation_bus.announce("principal.invalidate", usernames=keys)
+
+def clear_principals(announce: bool = True):
+    principal_cache.clear()
+    if announce:
+        invalidation_bus.announce("principals.clear")
+
+# Role and status changes on one worker reach the others' caches here, not after AMS_AUTH_CACHE_TTL
+invalidation_bus.register("principal.invalidate", lambda data: invalidate_principal(*data.get("usernames", []), announce=False))
+invalidation_bus.register("principals.clear", lambda data: clear_principals(announce=False))
+
+async def get_token_user(token: str, db: AsyncSession):
     credential_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -86,19 +242,26 @@ async def auth_current_user(token: str = Depends(oauth2_scheme), db: Session = D
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(payload)
         username: str = payload.get("sub")
         if username is None:
             raise credential_exception
         token_data = TokenData(username=username)
-    except JWTError as e:
-        print(e)
+    except JWTError:
         raise credential_exception
-    user = get_user_by_username(db, username=token_data.username)
-    print(user)
+    cache_key = token_data.username.lower()
+    cached_user = principal_cache.get(cache_key)
+    if cached_user is not None:
+        return await db.merge(cached_user, load=False)
+
+    user = await get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credential_exception
-    return user
+    db.expunge(user)
+    principal_cache.set(cache_key, user)
+    return await db.merge(user, load=False)
+
+async def auth_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    return await get_token_user(token, db)
 
 async def role_checker(required_role: str, user: User):
     if user.role != required_role:
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+BCRYPT_ROUNDS = int(os.getenv("AMS_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("AMS_HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv("AMS_HASH_QUEUE_SIZE", "64"))
+HASH_TIMEOUT = float(os.getenv("AMS_HASH_TIMEOUT", "5"))
+
+# Pinning min/max to the configured cost makes verify_and_update hand back a new hash whenever
+# a stored hash was made with a different cost, so changing AMS_BCRYPT_ROUNDS rehashes on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+def _hash_all(passwords: list) -> list:
+    return [pwd_context.hash(password) for password in passwords]
+
+class HasherError(RuntimeError):
+    """Raised when the hashing pool can't take or finish a call; routes turn it into a retryable 503/504."""
+
+class HasherBusy(HasherError):
+    pass
+
+class HasherTimeout(HasherError):
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a worker pool with a bounded backlog and per-call timeout.
+
+    bcrypt releases the GIL while hashing, so a thread pool spreads the work across cores."""
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE, timeout: float = HASH_TIMEOUT) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+
+    async def _run(self, fn, *args, timeout: Optional[float] = None):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Server is busy, try again shortly")
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise HasherTimeout("Password check timed out, try again shortly")
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        return await self._run(pwd_context.verify_and_update, password, hashed_password)
+
+    async def hash_many(self, passwords: list, chunk_size: int = 8) -> list:
+        # Bulk imports hash a few passwords per task with at most one task per worker in flight,
+        # so logins queued on the same pool still get a turn between chunks. Each chunk takes a
+        # slot like any other call, with the per-password timeout stretched over the chunk
+        in_flight = asyncio.Semaphore(self.workers)
+
+        async def hash_chunk(chunk):
+            async with in_flight:
+                return await self._run(_hash_all, chunk, timeout=self.timeout * len(chunk))
+
+        chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+        hashed = await asyncio.gather(*(hash_chunk(chunk) for chunk in chunks))
+        return [password_hash for chunk in hashed for password_hash in chunk]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher()
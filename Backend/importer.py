@@ -0,0 +1,238 @@
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, select, func as sql_func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from tables import User, Dates, month_day_key
+from schemas import UserSignUpInfo, StatusEnum, FileFormat, ImportReport, ImportRowError
+from hashing import password_hasher, HasherError
+
+load_dotenv()
+IMPORT_BATCH_SIZE = int(os.getenv("AMS_IMPORT_BATCH_SIZE", "500"))
+# An unclosed quote stops swallowing the following lines once the record grows past this
+MAX_CSV_RECORD_LENGTH = 64 * 1024
+
+async def stream_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def csv_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[Optional[List[str]], Optional[str]]]:
+    """(values, error) per CSV record. A quoted field may hold line breaks, so a line that leaves a
+    quote open is joined with the next ones until the parser sees the record end."""
+    pending = None
+    async for line in lines:
+        pending = line if pending is None else f"{pending}\n{line}"
+        try:
+            yield next(csv.reader([pending], strict=True)), None
+        except csv.Error as e:
+            if str(e) == "unexpected end of data" and len(pending) < MAX_CSV_RECORD_LENGTH:
+                continue
+            yield None, f"Invalid CSV: {e}"
+        pending = None
+    if pending is not None:
+        yield None, "Invalid CSV: unclosed quote at end of file"
+
+def parse_other_dates(value: str) -> list:
+    # CSV cells hold other_dates as "label=YYYY-MM-DD;label=YYYY-MM-DD"
+    other_dates = []
+    for item in filter(None, (part.strip() for part in (value or "").split(";"))):
+        label, _, event_date = item.partition("=")
+        other_dates.append({"label": label.strip(), "date": event_date.strip()})
+    return other_dates
+
+def _validation_messages(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+# Read off the table so a migration that widens a column widens the check with it
+MEMBER_COLUMN_LENGTHS = {
+    name: User.__table__.c[name].type.length
+    for name in ("first_name", "last_name", "phone_number", "email", "timezone", "username")
+}
+LABEL_LENGTH = Dates.__table__.c.label.type.length
+
+def _length_messages(member: UserSignUpInfo) -> List[str]:
+    # Postgres rejects an over-long value with an error that would otherwise take its whole batch down
+    messages = [
+        f"{name}: at most {length} characters"
+        for name, length in MEMBER_COLUMN_LENGTHS.items()
+        if len(getattr(member, name) or "") > length
+    ]
+    messages.extend(
+        f"other_dates.{index}.label: at most {LABEL_LENGTH} characters"
+        for index, od in enumerate(member.other_dates or [])
+        if len(od.label) > LABEL_LENGTH
+    )
+    return messages
+
+class MemberImporter:
+    """Validates rows as they stream in and writes them in batches, collecting a per-row error report."""
+
+    def __init__(self, db: AsyncSession, status: StatusEnum = StatusEnum.pending, batch_size: int = IMPORT_BATCH_SIZE) -> None:
+        self.db = db
+        self.status = status
+        self.batch_size = batch_size
+        self.imported = 0
+        self.errors: List[ImportRowError] = []
+        self._batch: list = []
+        self._seen_usernames: set = set()
+
+    def fail(self, row: int, username, errors: List[str]) -> None:
+        self.errors.append(ImportRowError(row=row, username=username, errors=errors))
+
+    async def add(self, row: int, record: dict) -> None:
+        try:
+            member = UserSignUpInfo.model_validate(record)
+        except ValidationError as e:
+            self.fail(row, record.get("username") if isinstance(record, dict) else None, _validation_messages(e))
+            return
+        too_long = _length_messages(member)
+        if too_long:
+            self.fail(row, member.username, too_long)
+            return
+        key = member.username.lower()
+        if key in self._seen_usernames:
+            self.fail(row, member.username, ["Duplicate username in file"])
+            return
+        self._seen_usernames.add(key)
+        self._batch.append((row, member))
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        existing = set((await self.db.scalars(
+            select(sql_func.lower(User.username)).where(sql_func.lower(User.username).in_([m.username.lower() for _, m in batch]))
+        )).all())
+        fresh = []
+        for row, member in batch:
+            if member.username.lower() in existing:
+                self.fail(row, member.username, ["Existing username"])
+            else:
+                fresh.append((row, member))
+        if not fresh:
+            return
+
+        try:
+            password_hashes = await password_hasher.hash_many([member.password for _, member in fresh])
+        except HasherError as e:
+            # The pool is shared with logins; a batch it turns away is reported for a later retry
+            for row, member in fresh:
+                self.fail(row, member.username, [str(e)])
+            return
+        now = datetime.now()
+        # Bulk INSERTs skip mapper events, so the month-day keys are filled in here
+        users = [
+            {
+                "first_name": member.first_name,
+                "last_name": member.last_name,
+                "phone_number": member.phone_number,
+                "email": member.email,
+                "channels": member.channels,
+                "timezone": member.timezone,
+                "send_hour": member.send_hour,
+                "username": member.username,
+                "password": password_hash,
+                "dob": member.dob,
+                "dob_month_day": month_day_key(member.dob),
+                "role": "user",
+                "status": self.status,
+                "date": now,
+            }
+            for (_, member), password_hash in zip(fresh, password_hashes)
+        ]
+        try:
+            await self._insert([member for _, member in fresh], users)
+            await self.db.commit()
+        except SQLAlchemyError:
+            await self.db.rollback()
+            await self._insert_each(fresh, users)
+            return
+        self.imported += len(fresh)
+
+    async def _insert(self, members: List[UserSignUpInfo], users: List[dict]) -> None:
+        inserted = (await self.db.execute(insert(User).returning(User.id, User.username), users)).all()
+        user_ids = {username: user_id for user_id, username in inserted}
+        dates = [
+            {"user_id": user_ids[member.username], "label": od.label, "date": od.date, "month_day": month_day_key(od.date)}
+            for member in members
+            for od in member.other_dates or []
+        ]
+        if dates:
+            await self.db.execute(insert(Dates), dates)
+
+    async def _insert_each(self, fresh: list, users: List[dict]) -> None:
+        # The batch failed as a whole; one SAVEPOINT per row keeps the good rows and names the bad ones
+        for (row, member), user in zip(fresh, users):
+            try:
+                async with self.db.begin_nested():
+                    await self._insert([member], [user])
+            except SQLAlchemyError as e:
+                self.fail(row, member.username, [f"Insert failed: {e.__class__.__name__}"])
+            else:
+                self.imported += 1
+        await self.db.commit()
+
+    def report(self) -> ImportReport:
+        self.errors.sort(key=lambda error: error.row)
+        return ImportReport(imported=self.imported, failed=len(self.errors), errors=self.errors)
+
+async def import_members(db: AsyncSession, lines: AsyncIterator[str], file_format: FileFormat, status: StatusEnum) -> ImportReport:
+    importer = MemberImporter(db, status=status)
+    header = None
+    row = 0
+    if file_format == FileFormat.csv:
+        # Rows are numbered by record, so a quoted field spanning lines is still one row in the report
+        async for values, error in csv_records(lines):
+            if error is None and not any(value.strip() for value in values):
+                continue
+            if header is None:
+                if error:
+                    importer.fail(0, None, [error])
+                    break
+                header = [column.strip() for column in values]
+                continue
+            row += 1
+            if error:
+                importer.fail(row, None, [error])
+                continue
+            record = dict(zip(header, values))
+            record["other_dates"] = parse_other_dates(record.get("other_dates", ""))
+            # Blank optional cells mean "not given" rather than an empty value
+            if not (record.get("email") or "").strip():
+                record["email"] = None
+            for optional in ("channels", "timezone", "send_hour"):
+                if not (record.get(optional) or "").strip():
+                    record.pop(optional, None)
+            await importer.add(row, record)
+    else:
+        async for line in lines:
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                importer.fail(row, None, [f"Invalid JSON: {e.msg}"])
+                continue
+            if not isinstance(record, dict):
+                importer.fail(row, None, ["Expected a JSON object"])
+                continue
+            await importer.add(row, record)
+    await importer.flush()
+    return importer.report()
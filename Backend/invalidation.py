@@ -0,0 +1,65 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict
+from dotenv import load_dotenv
+from broker import build_broker, event_message
+
+load_dotenv()
+# Kept apart from the dashboard channel so cache traffic never reaches WebSocket clients
+INVALIDATION_CHANNEL = os.getenv("AMS_INVALIDATION_CHANNEL", "ams_invalidations")
+
+logger = logging.getLogger(__name__)
+
+class InvalidationBus:
+    """Relays cache invalidations to every worker through the events broker.
+
+    Each process-local cache (recipient snapshot, principal cache) clears itself straight away
+    and announces the change; the other workers run the registered handler when it arrives.
+    A worker skips its own announcements, which it has already applied.
+    """
+
+    def __init__(self, broker) -> None:
+        self.broker = broker
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, Callable[[dict], None]] = {}
+        self._publishing: set = set()
+
+    def register(self, name: str, handler: Callable[[dict], None]) -> None:
+        self._handlers[name] = handler
+
+    async def start(self) -> None:
+        await self.broker.start(self._receive)
+
+    async def stop(self) -> None:
+        if self._publishing:
+            await asyncio.gather(*self._publishing, return_exceptions=True)
+        await self.broker.stop()
+
+    def announce(self, name: str, **data) -> None:
+        # Called from sync code paths (routes, cache methods); without a running loop there is no one to tell
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        publishing = loop.create_task(self._publish(name, data))
+        self._publishing.add(publishing)
+        publishing.add_done_callback(self._publishing.discard)
+
+    async def _publish(self, name: str, data: dict) -> None:
+        try:
+            await self.broker.publish(event_message(name, {"origin": self.origin, **data}))
+        except Exception:
+            logger.exception("Publishing invalidation %s failed", name)
+
+    async def _receive(self, message: str) -> None:
+        event = json.loads(message)
+        data = event.get("data", {})
+        handler = self._handlers.get(event.get("type"))
+        if handler is None or data.get("origin") == self.origin:
+            return
+        handler(data)
+
+invalidation_bus = InvalidationBus(build_broker(INVALIDATION_CHANNEL))
@@ -1,48 +1,78 @@
-from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect
+from fastapi import FastAPI
 from contextlib import asynccontextmanager
-from fastapi.responses import HTMLResponse
+from dotenv import load_dotenv
 import asyncio
-from dataclasses import dataclass
+import os
 from user import user_router
 from schemas import DummyUser
-from tables import get_db, User, Dates
+from tables import get_db, User, engine, async_engine
 from func import create_fake_user
 from message import message_router
+from admin import admin_router
+from events import events_router, connection_manager
+from invalidation import invalidation_bus
+from snapshot import refresh_daily
+from scheduler import send_scheduler, SCHEDULER_ENABLED
+from hashing import password_hasher
+from callbacks import callback_router, status_buffer
+from metrics import MetricsMiddleware, metrics_router, instrument_engines
+
+load_dotenv()
+# The dummy user costs a bcrypt hash and a few queries per boot, so it's only seeded when asked for
+# (local testing); "python manage.py seed-dummy-user" does the same once, outside the app
+SEED_DUMMY_USER = os.getenv("AMS_SEED_DUMMY_USER", "false").lower() in ("1", "true", "yes")
 
 dummy_user_data = DummyUser()
 
+def seed_dummy_user():
+    db = next(get_db())
+    try:
+        create_fake_user(dummy_user_data, db)
+    finally:
+        db.close()
+
+def remove_dummy_user():
+    db = next(get_db())
+    try:
+        dummy_query = db.query(User).filter(User.username == dummy_user_data.username).first()
+        if dummy_query:
+            db.delete(dummy_query)
+            db.commit()
+    finally:
+        db.close()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    db = next(get_db()) 
-    create_fake_user(dummy_user_data, db)
+    if SEED_DUMMY_USER:
+        await asyncio.to_thread(seed_dummy_user)
+    await connection_manager.start()
+    await invalidation_bus.start()
+    status_buffer.start()
+    snapshot_job = asyncio.create_task(refresh_daily())
+    scheduler_job = asyncio.create_task(send_scheduler.run()) if SCHEDULER_ENABLED else None
     
     yield  
     
-    dummy_query = db.query(User).filter(User.username == dummy_user_data.username).first()
-    if dummy_query:
-        db.delete(dummy_query)
-        db.commit()
+    snapshot_job.cancel()
+    if scheduler_job:
+        scheduler_job.cancel()
+    await status_buffer.stop()
+    await invalidation_bus.stop()
+    await connection_manager.stop()
+    
+    if SEED_DUMMY_USER:
+        await asyncio.to_thread(remove_dummy_user)
+    password_hasher.shutdown()
+    await async_engine.dispose()
     
 
 app = FastAPI(lifespan=lifespan)
-
-@dataclass
-class ConnectionManager:
-    def __init__(self) -> None:
-        self.active_connections: list = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections: 
-            await connection.send_text(message)
-
-    async def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-connection_manager = ConnectionManager()
+app.add_middleware(MetricsMiddleware)
+instrument_engines(engine, async_engine.sync_engine)
 
 app.include_router(user_router, prefix="/user", tags=["User"])
-app.include_router(message_router, prefix="/message", tags=["Message"])
\ No newline at end of file
+app.include_router(message_router, prefix="/message", tags=["Message"])
+app.include_router(admin_router, prefix="/admin", tags=["Admin"])
+app.include_router(callback_router, prefix="/callbacks", tags=["Callbacks"])
+app.include_router(events_router, prefix="/ws", tags=["Events"])
+app.include_router(metrics_router)
\ No newline at end of file
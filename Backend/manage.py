@@ -0,0 +1,46 @@
+"""Setup commands that used to run on every app start.
+
+    python manage.py migrate              # alembic upgrade head
+    python manage.py seed-dummy-user      # add the local-testing admin (DummyUser in schemas.py)
+    python manage.py remove-dummy-user
+"""
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def migrate(args):
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    command.upgrade(config, args.revision)
+
+def seed(args):
+    from main import seed_dummy_user, dummy_user_data
+
+    seed_dummy_user()
+    print(f"Dummy user '{dummy_user_data.username}' is ready")
+
+def unseed(args):
+    from main import remove_dummy_user
+
+    remove_dummy_user()
+    print("Dummy user removed")
+
+def main():
+    sys.path.insert(0, BACKEND_DIR)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="apply database migrations")
+    migrate_parser.add_argument("revision", nargs="?", default="head")
+    migrate_parser.set_defaults(handler=migrate)
+    commands.add_parser("seed-dummy-user", help="create the dummy admin used for local testing").set_defaults(handler=seed)
+    commands.add_parser("remove-dummy-user", help="delete the dummy admin").set_defaults(handler=unseed)
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
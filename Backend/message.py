@@ -1,108 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import extract
-from tables import User, Dates, get_db
-from func import auth_current_user, role_checker
-from schemas import MessagePreview, EventType, CustomMessage
-from datetime import date
-from typing import List
-import os
-from twilio.rest import Client
-from dotenv import load_dotenv
-
-load_dotenv()
-message_router = APIRouter()
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from tables import User, Dates, MessageTemplate, DeliveryLog, OutboundMessage, get_async_db
+from func import auth_current_user, role_checker, enqueue_messages, month_day_in, occurrence_between, keyset_page
+from schemas import MessagePreview, EventType, CustomMessage, CustomMessageResult, TemplateCreate, TemplateUpdate, TemplateInfo, UpcomingEvent, UpcomingDay, StatusEnum, DeliveryLogEntry
+from templates import CompiledTemplate, TemplateError, template_cache, render_messages
+from dispatch import OutgoingMessage
+from snapshot import recipient_snapshot, Recipient
+from events import connection_manager
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import List, Optional
 
-twilio_sid = os.getenv("TWILIO_ACCOUNT_SID")
-twilio_token = os.getenv("TWILIO_AUTH_TOKEN")
-twilio_number = os.getenv("TWILIO_PHONE_NUMBER")
-if not all([twilio_sid, twilio_token, twilio_number]):
-    raise RuntimeError("Twilio credentials not set in environment")
+message_router = APIRouter()
 
-twilio_client = Client(twilio_sid, twilio_token)
+LOG_PAGE_SIZE = 100
+MAX_LOG_PAGE_SIZE = 1000
 
 @message_router.post("/write-message", response_model=List[MessagePreview])
-async def generate_message(event_type: EventType, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def generate_message(event_type: EventType, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     today = date.today()
     messages = []
 
-    bday_query = db.query(User).filter(extract("month", User.dob)== today.month, extract("day", User.dob)== today.day).all()
-    ann_query = db.query(Dates).filter(extract("month", Dates.date)== today.month, extract("day", Dates.date)== today.day).all()
-    others_query = db.query(Dates).filter(Dates.label.notin_(["birthday", "anniversary"]), extract("month", Dates.date) == today.month, extract("day", Dates.date) == today.day).all()
+    recipients = await recipient_snapshot.get(db, today)
 
-    if not bday_query:
+    if not recipients[EventType.birthday]:
         raise HTTPException(status_code=404, detail="No user has a birthday today")
     
-    if not ann_query:
+    if not recipients[EventType.anniversary]:
         raise HTTPException(status_code=404, detail="No user has a anniversary today")
     
-    if not others_query:
+    if not recipients[EventType.others]:
         raise HTTPException(status_code=404, detail="No user has an event today")
 
-    if event_type == EventType.birthday:
-        for user in bday_query:
-            message=f"Happy Birthday, {user.first_name}! 🎉"
-            phone = user.phone_number
-            # Send using Twilio 
-            # twilio_client.messages.create(
-            #     body=message,
-            #     from_=twilio_number,
-            #     to=phone
-            # )
-            messages.append(MessagePreview(username=user.username, first_name=user.first_name, last_name=user.last_name, message=message, event_type=event_type))
-    
-    elif event_type == EventType.anniversary:
-        for user in ann_query:
-            message=f"Happy Anniversary, {user.user.first_name}! 🎉"
-            phone = user.user.phone_number
-            # Send using Twilio 
-            # twilio_client.messages.create(
-            #     body=message,
-            #     from_=twilio_number,
-            #     to=phone
-            # )
-            messages.append(MessagePreview(username=user.user.username, message=message, event_type=event_type))
-    
-    elif event_type == EventType.others:
-        for user in others_query:
-             message=f"Happy {user.label}, {user.user.first_name}! 🎉"
-             phone = user.user.phone_number
-            # Send using Twilio 
-            # twilio_client.messages.create(
-            #     body=message,
-            #     from_=twilio_number,
-            #     to=phone
-            # )
-             messages.append(MessagePreview(username=user.user.username, message=message, event_type=event_type))
-
-    else:
+    if event_type not in (EventType.birthday, EventType.anniversary, EventType.others):
        raise HTTPException(status_code=404, detail="No message template available for this event")
 
+    # Templates are looked up and compiled once for the whole batch, never per recipient
+    templates = await template_cache.load(db, event_type)
+    selected = recipients[event_type]
+    outgoing = []
+    for recipient, message in zip(selected, render_messages(event_type, templates, selected)):
+        outgoing.append(OutgoingMessage(username=recipient.username, phone_number=recipient.phone_number, body=message, user_id=recipient.user_id, label=recipient.label, email=recipient.email, channels=recipient.channels))
+
+    # Recipients already served for today's occurrence are skipped, so calling this twice doesn't re-send
+    queued = {id(message) for message in await enqueue_messages(db, outgoing, event_type.value, today)}
+    if queued:
+        await connection_manager.publish("delivery.queued", {"event_type": event_type.value, "count": len(queued)})
+    for message in outgoing:
+        messages.append(MessagePreview(username=message.username, message=message.body, event_type=event_type, delivery_status="queued" if id(message) in queued else "skipped"))
+
     return messages
 
-@message_router.post("/custom-message", response_model=List[CustomMessage])
-async def set_custom_message(custom_message_data: CustomMessage, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+@message_router.post("/custom-message", response_model=List[CustomMessageResult])
+async def set_custom_message(custom_message_data: CustomMessage, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
 
     today = date.today()
     recipients = []
 
     if custom_message_data.username:
-        user = db.query(User).filter(User.username == custom_message_data.username).first()
+        user = await db.scalar(select(User).where(User.username == custom_message_data.username))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        recipients = [user]
+        recipients = [Recipient(user_id=user.id, username=user.username, first_name=user.first_name, phone_number=user.phone_number, email=user.email, channels=user.channels.value)]
 
     else:
-        if custom_message_data.event_type == EventType.birthday:
-            recipients = (db.query(User).filter( extract("month", User.dob) == today.month, extract("day", User.dob) == today.day).all())
-
-        elif custom_message_data.event_type == EventType.anniversary:
-            recipients = (db.query(Dates).filter(extract("month", Dates.date) == today.month, extract("day", Dates.date) == today.day, Dates.label == "anniversary").all())
-
-        elif custom_message_data.event_type == EventType.others:
-            recipients = (db.query(Dates).filter(extract("month", Dates.date) == today.month, extract("day", Dates.date) == today.day, Dates.label.notin_(["birthday", "anniversary"])).all())
+        if custom_message_data.event_type in (EventType.birthday, EventType.anniversary, EventType.others):
+            recipients = (await recipient_snapshot.get(db, today))[custom_message_data.event_type]
     
         else:
                 raise HTTPException(status_code=400, detail="Invalid event type, enter a valid event type (birthday, anniversary, others)")
@@ -110,33 +77,156 @@ async def set_custom_message(custom_message_data: CustomMessage, db: Session = D
     if not recipients:
         raise HTTPException(status_code=404, detail="No recipients found")
     
-    custom_messages = []
+    outgoing = []
+    for recipient in recipients:
+        outgoing.append(OutgoingMessage(username=recipient.username, phone_number=recipient.phone_number, body=custom_message_data.message, user_id=recipient.user_id, label=recipient.label, email=recipient.email, channels=recipient.channels))
 
-    for custom_messages_recipient in recipients:
-        if isinstance(custom_messages_recipient, User):
-            phone = custom_messages_recipient.phone_number
-            username = custom_messages_recipient.username
-            first_name = custom_messages_recipient.first_name
-        else:
-            phone = custom_messages_recipient.user.phone_number
-            username = custom_messages_recipient.user.username
-            first_name = custom_messages_recipient.user.first_name
-
-        # Send using Twilio 
-            # twilio_client.messages.create(
-            #     body=message_template.message,
-            #     from_=twilio_number,
-            #     to=phone
-            # )
-            
+    # The same text to the same recipient for the same occurrence is only queued once
+    queued = {id(message) for message in await enqueue_messages(db, outgoing, custom_message_data.event_type.value, today, custom=True)}
+    if queued:
+        await connection_manager.publish("delivery.queued", {"event_type": custom_message_data.event_type.value, "count": len(queued)})
+
+    custom_messages = []
+    for message in outgoing:
         custom_messages.append(
             {
-                "username": username,
-                "first_name": first_name,
-                "phone_number": phone,
+                "username": message.username,
+                "phone_number": message.phone_number,
                 "event_type": custom_message_data.event_type,
                 "message": custom_message_data.message,
+                "delivery_status": "queued" if id(message) in queued else "skipped",
             }
         )
 
     return custom_messages
+
+@message_router.get("/upcoming-events", response_model=List[UpcomingDay])
+async def upcoming_events(
+    days: int = Query(30, ge=1, le=366),
+    start: Optional[date] = None,
+    status: Optional[StatusEnum] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
+    await role_checker(required_role="admin", user=user)
+    start = start or date.today()
+    end = start + timedelta(days=days - 1)
+
+    # Range scans on the indexed month-day keys; a window that crosses New Year becomes two ranges
+    member = (User.id, User.username, User.first_name, User.last_name)
+    birthdays = select(*member, User.dob).where(month_day_in(User.dob_month_day, start, end))
+    other_dates = select(*member, Dates.label, Dates.date).join(User, User.id == Dates.user_id).where(month_day_in(Dates.month_day, start, end))
+    if status:
+        birthdays = birthdays.where(User.status == status)
+        other_dates = other_dates.where(User.status == status)
+
+    events = [("birthday", row.dob, row) for row in (await db.execute(birthdays)).all()]
+    events += [(row.label, row.date, row) for row in (await db.execute(other_dates)).all()]
+
+    calendar = defaultdict(lambda: defaultdict(list))
+    for label, original, row in events:
+        occurrence = occurrence_between(original, start, end)
+        if occurrence:
+            calendar[occurrence][label].append(UpcomingEvent(
+                user_id=row.id, username=row.username, first_name=row.first_name, last_name=row.last_name,
+                date=original, years=occurrence.year - original.year,
+            ))
+
+    return [UpcomingDay(date=day, events=calendar[day]) for day in sorted(calendar)]
+
+@message_router.get("/logs", response_model=List[DeliveryLogEntry])
+async def delivery_logs(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(LOG_PAGE_SIZE, ge=1, le=MAX_LOG_PAGE_SIZE),
+    user_id: Optional[int] = None,
+    event_type: Optional[EventType] = None,
+    label: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
+    await role_checker(required_role="admin", user=user)
+    page = select(DeliveryLog.id)
+    # Filters follow the (user_id, event_type, label, send_date) index column order
+    if user_id is not None:
+        page = page.where(DeliveryLog.user_id == user_id)
+    if event_type:
+        page = page.where(DeliveryLog.event_type == event_type.value)
+    if label is not None:
+        page = page.where(DeliveryLog.label == label)
+    if date_from:
+        page = page.where(DeliveryLog.send_date >= date_from)
+    if date_to:
+        page = page.where(DeliveryLog.send_date <= date_to)
+    page_ids = keyset_page(page, DeliveryLog.id, after_id, limit).subquery()
+
+    # The page is cut on log ids first, so a log entry's per-channel outbox rows are never split across pages
+    logs = (await db.execute(
+        select(
+            DeliveryLog.id, DeliveryLog.user_id, DeliveryLog.username, DeliveryLog.event_type, DeliveryLog.label,
+            DeliveryLog.send_date, DeliveryLog.body, DeliveryLog.created_at, OutboundMessage.channel,
+            OutboundMessage.status.label("delivery_status"), OutboundMessage.attempts, OutboundMessage.sent_at, OutboundMessage.last_error,
+            OutboundMessage.provider_status, OutboundMessage.provider_error, OutboundMessage.provider_status_at,
+        )
+        .join(page_ids, page_ids.c.id == DeliveryLog.id)
+        .outerjoin(OutboundMessage, OutboundMessage.delivery_log_id == DeliveryLog.id)
+        .order_by(DeliveryLog.id, OutboundMessage.id)
+    )).all()
+    if len({row.id for row in logs}) == limit:
+        response.headers["X-Next-Cursor"] = str(logs[-1].id)
+    return logs
+
+@message_router.get("/templates", response_model=List[TemplateInfo])
+async def list_templates(event_type: Optional[EventType] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    statement = select(MessageTemplate).order_by(MessageTemplate.event_type, MessageTemplate.label)
+    if event_type:
+        statement = statement.where(MessageTemplate.event_type == event_type.value)
+    return (await db.scalars(statement)).all()
+
+@message_router.post("/templates", response_model=TemplateInfo)
+async def create_template(template_data: TemplateCreate, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    try:
+        CompiledTemplate(template_data.body)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    template = MessageTemplate(event_type=template_data.event_type.value, label=template_data.label.strip(), body=template_data.body, version=1)
+    db.add(template)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="A template for this event type and label already exists")
+    return template
+
+@message_router.put("/templates/{template_id}", response_model=TemplateInfo)
+async def update_template(template_id: int, template_data: TemplateUpdate, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    try:
+        CompiledTemplate(template_data.body)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    template = await db.get(MessageTemplate, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    template.body = template_data.body
+    template.version += 1
+    await db.commit()
+    template_cache.invalidate(template.event_type, template.label)
+    return template
+
+@message_router.delete("/templates/{template_id}")
+async def delete_template(template_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    template = await db.get(MessageTemplate, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    await db.delete(template)
+    await db.commit()
+    template_cache.invalidate(template.event_type, template.label)
+    return {"detail": "Template has been deleted"}
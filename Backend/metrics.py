@@ -0,0 +1,172 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+load_dotenv()
+# Requests slower than this are logged with the SQL they ran; 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv("AMS_SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("AMS_SLOW_REQUEST_MAX_STATEMENTS", "20"))
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("AMS_METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("ams.slow_requests")
+
+class Histogram:
+    """Cumulative histogram per label set, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            # One counter per bucket plus +Inf, then the running sum
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RequestStats:
+    """SQL activity of one request, filled in by the engine listeners below."""
+
+    __slots__ = ("statements", "db_time", "log")
+
+    def __init__(self, keep_statements: bool) -> None:
+        self.statements = 0
+        self.db_time = 0.0
+        self.log: Optional[List[Tuple[str, float]]] = [] if keep_statements else None
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+class RequestMetrics:
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.latency = Histogram("ams_http_request_duration_seconds", "Time to serve a request, including streamed bodies.", ("method", "route", "status"), LATENCY_BUCKETS)
+        self.db_statements = Histogram("ams_db_statements_per_request", "SQL statements executed while serving a request.", ("method", "route"), STATEMENT_BUCKETS)
+        self.db_time = Histogram("ams_db_time_per_request_seconds", "Time spent in SQL statements while serving a request.", ("method", "route"), LATENCY_BUCKETS)
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, collector: Callable[[], List[str]]) -> None:
+        # Other components (e.g. the callback buffer) append their own series to /metrics
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP ams_http_requests_in_flight Requests currently being served.",
+            "# TYPE ams_http_requests_in_flight gauge",
+            f"ams_http_requests_in_flight {self.in_flight}",
+        ]
+        for histogram in (self.latency, self.db_statements, self.db_time):
+            lines.extend(histogram.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        # A connection runs one statement at a time, so a single slot is enough
+        conn.info["query_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    started = conn.info.pop("query_started", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.statements += 1
+    stats.db_time += elapsed
+    if stats.log is not None and len(stats.log) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.log.append((statement, elapsed))
+
+def instrument_engines(*engines) -> None:
+    # The async engine's statements run in greenlets that share the request's context, so listening
+    # on async_engine.sync_engine attributes them to the right request too
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so the timing covers streamed responses and the stats context reaches the endpoint."""
+
+    def __init__(self, app, metrics: RequestMetrics = request_metrics, slow_request_ms: float = SLOW_REQUEST_MS) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(keep_statements=self.slow_request_ms > 0)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.in_flight -= 1
+            current_request.reset(token)
+            # Label by route template rather than raw path so ids don't explode the series count
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            self.metrics.latency.observe((scope["method"], route_path, str(status_code)), elapsed)
+            self.metrics.db_statements.observe((scope["method"], route_path), stats.statements)
+            self.metrics.db_time.observe((scope["method"], route_path), stats.db_time)
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                self._log_slow(scope, status_code, elapsed, stats)
+
+    def _log_slow(self, scope, status_code: int, elapsed: float, stats: RequestStats) -> None:
+        statements = "\n".join(f"  {duration * 1000:.1f} ms  {' '.join(statement.split())}" for statement, duration in stats.log)
+        logger.warning(
+            "Slow request %s %s -> %s took %.1f ms (%d SQL statements, %.1f ms in SQL)\n%s",
+            scope["method"], scope["path"], status_code, elapsed * 1000, stats.statements, stats.db_time * 1000, statements,
+        )
+
+metrics_router = APIRouter()
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,45 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Databases created before migrations existed already have these tables (Base.metadata.create_all)
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if "user_info" not in existing:
+        op.create_table(
+            "user_info",
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("first_name", sa.String(256), nullable=False),
+            sa.Column("last_name", sa.String(256)),
+            sa.Column("phone_number", sa.String(15), nullable=False),
+            sa.Column("username", sa.String(256), unique=True),
+            sa.Column("password", sa.String(256), nullable=False),
+            sa.Column("dob", sa.Date),
+            sa.Column("profile_pic", sa.LargeBinary, nullable=True),
+            sa.Column("role", sa.String(50)),
+            sa.Column("status", sa.Enum("pending", "active", name="statusenum"), nullable=False),
+            sa.Column("date", sa.DateTime),
+        )
+    if "other_dates" not in existing:
+        op.create_table(
+            "other_dates",
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user_info.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("label", sa.String(256), nullable=False),
+            sa.Column("date", sa.Date, nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("other_dates")
+    op.drop_table("user_info")
+    sa.Enum(name="statusenum").drop(op.get_bind(), checkfirst=True)
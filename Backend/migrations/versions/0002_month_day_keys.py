@@ -0,0 +1,42 @@
+"""month-day lookup keys for birthdays and other dates
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+KEYS = [
+    # (table, date column, key column)
+    ("user_info", "dob", "dob_month_day"),
+    ("other_dates", "date", "month_day"),
+]
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name, date_column, key_column in KEYS:
+        if key_column not in {c["name"] for c in inspector.get_columns(table_name)}:
+            op.add_column(table_name, sa.Column(key_column, sa.SmallInteger, nullable=True))
+
+        table = sa.table(table_name, sa.column(date_column, sa.Date), sa.column(key_column, sa.SmallInteger))
+        source = table.c[date_column]
+        op.execute(
+            table.update()
+            .where(source.isnot(None))
+            .values({key_column: sa.cast(sa.extract("month", source) * 100 + sa.extract("day", source), sa.SmallInteger)})
+        )
+
+        index_name = f"ix_{table_name}_{key_column}"
+        if index_name not in {i["name"] for i in inspector.get_indexes(table_name)}:
+            op.create_index(index_name, table_name, [key_column])
+
+def downgrade():
+    for table_name, _, key_column in KEYS:
+        op.drop_index(f"ix_{table_name}_{key_column}", table_name=table_name)
+        op.drop_column(table_name, key_column)
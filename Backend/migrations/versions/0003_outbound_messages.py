@@ -0,0 +1,39 @@
+"""outbound_messages outbox
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if "outbound_messages" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "outbound_messages",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user_info.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("username", sa.String(256)),
+        sa.Column("phone_number", sa.String(15), nullable=False),
+        sa.Column("body", sa.Text, nullable=False),
+        sa.Column("event_type", sa.String(50)),
+        sa.Column("status", sa.Enum("pending", "sending", "sent", "failed", name="outboxstatusenum"), nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("provider_id", sa.String(64)),
+        sa.Column("last_error", sa.Text),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.Column("claimed_at", sa.DateTime),
+        sa.Column("sent_at", sa.DateTime),
+    )
+    op.create_index("ix_outbound_messages_status_id", "outbound_messages", ["status", "id"])
+
+def downgrade():
+    op.drop_index("ix_outbound_messages_status_id", table_name="outbound_messages")
+    op.drop_table("outbound_messages")
+    sa.Enum(name="outboxstatusenum").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,30 @@
+"""message_templates
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if "message_templates" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "message_templates",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("event_type", sa.String(50), nullable=False),
+        sa.Column("label", sa.String(256), nullable=False, server_default=""),
+        sa.Column("body", sa.Text, nullable=False),
+        sa.Column("version", sa.Integer, nullable=False, server_default="1"),
+        sa.Column("updated_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("event_type", "label", name="uq_message_templates_event_type_label"),
+    )
+
+def downgrade():
+    op.drop_table("message_templates")
@@ -0,0 +1,57 @@
+"""move profile pictures to the avatar store
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+import os
+from alembic import op
+import sqlalchemy as sa
+from avatars import avatar_store, AvatarError
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    bind = op.get_bind()
+    columns = {column["name"] for column in sa.inspect(bind).get_columns("user_info")}
+    if "avatar_etag" not in columns:
+        op.add_column("user_info", sa.Column("avatar_etag", sa.String(64), nullable=True))
+        op.add_column("user_info", sa.Column("avatar_content_type", sa.String(50), nullable=True))
+    if "profile_pic" not in columns:
+        return
+
+    # Existing pictures are written to the store one row at a time so the whole column is never in memory
+    user_info = sa.table("user_info", sa.column("id"), sa.column("avatar_etag"), sa.column("avatar_content_type"))
+    stored = []
+    rows = bind.execution_options(stream_results=True, yield_per=100).execute(
+        sa.text("SELECT id, profile_pic FROM user_info WHERE profile_pic IS NOT NULL")
+    )
+    for user_id, data in rows:
+        try:
+            etag, content_type = avatar_store.store_bytes(user_id, bytes(data))
+        except AvatarError as e:
+            print(f"Skipping profile picture of user {user_id}: {e}")
+            continue
+        stored.append({"user_id": user_id, "etag": etag, "content_type": content_type})
+    if stored:
+        bind.execute(
+            user_info.update().where(user_info.c.id == sa.bindparam("user_id"))
+            .values(avatar_etag=sa.bindparam("etag"), avatar_content_type=sa.bindparam("content_type")),
+            stored,
+        )
+    op.drop_column("user_info", "profile_pic")
+
+def downgrade():
+    bind = op.get_bind()
+    op.add_column("user_info", sa.Column("profile_pic", sa.LargeBinary, nullable=True))
+    user_info = sa.table("user_info", sa.column("id"), sa.column("profile_pic"))
+    for (user_id,) in bind.execute(sa.text("SELECT id FROM user_info WHERE avatar_etag IS NOT NULL")).all():
+        path = avatar_store.path(user_id)
+        if os.path.exists(path):
+            with open(path, "rb") as image:
+                bind.execute(user_info.update().where(user_info.c.id == user_id).values(profile_pic=image.read()))
+    op.drop_column("user_info", "avatar_content_type")
+    op.drop_column("user_info", "avatar_etag")
@@ -0,0 +1,43 @@
+"""delivery_log with idempotency keys
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "delivery_log" not in inspector.get_table_names():
+        op.create_table(
+            "delivery_log",
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("idempotency_key", sa.String(64), nullable=False, unique=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user_info.id", ondelete="SET NULL"), nullable=True),
+            sa.Column("username", sa.String(256)),
+            sa.Column("event_type", sa.String(50), nullable=False),
+            sa.Column("label", sa.String(256), nullable=False, server_default=""),
+            sa.Column("send_date", sa.Date, nullable=False),
+            sa.Column("body", sa.Text, nullable=False),
+            sa.Column("created_at", sa.DateTime, nullable=False),
+        )
+        op.create_index("ix_delivery_log_occurrence", "delivery_log", ["user_id", "event_type", "label", "send_date"])
+    if "delivery_log_id" not in {column["name"] for column in inspector.get_columns("outbound_messages")}:
+        with op.batch_alter_table("outbound_messages") as batch_op:
+            batch_op.add_column(sa.Column("delivery_log_id", sa.Integer, nullable=True))
+            batch_op.create_foreign_key("fk_outbound_messages_delivery_log_id", "delivery_log", ["delivery_log_id"], ["id"], ondelete="SET NULL")
+            batch_op.create_index("ix_outbound_messages_delivery_log_id", ["delivery_log_id"])
+
+def downgrade():
+    with op.batch_alter_table("outbound_messages") as batch_op:
+        batch_op.drop_index("ix_outbound_messages_delivery_log_id")
+        batch_op.drop_constraint("fk_outbound_messages_delivery_log_id", type_="foreignkey")
+        batch_op.drop_column("delivery_log_id")
+    op.drop_index("ix_delivery_log_occurrence", table_name="delivery_log")
+    op.drop_table("delivery_log")
@@ -0,0 +1,47 @@
+"""member email and channel preference; per-channel outbox rows
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+channel_preference = sa.Enum("sms", "email", "both", name="channelpreference")
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    user_columns = {column["name"] for column in inspector.get_columns("user_info")}
+    if "channels" not in user_columns:
+        channel_preference.create(op.get_bind(), checkfirst=True)
+        with op.batch_alter_table("user_info") as batch_op:
+            batch_op.add_column(sa.Column("email", sa.String(256), nullable=True))
+            batch_op.add_column(sa.Column("channels", channel_preference, nullable=False, server_default="sms"))
+
+    outbox_columns = {column["name"] for column in inspector.get_columns("outbound_messages")}
+    if "channel" not in outbox_columns:
+        with op.batch_alter_table("outbound_messages") as batch_op:
+            batch_op.add_column(sa.Column("channel", sa.String(10), nullable=False, server_default="sms"))
+            batch_op.add_column(sa.Column("email", sa.String(256), nullable=True))
+            batch_op.alter_column("phone_number", existing_type=sa.String(15), nullable=True)
+            batch_op.drop_index("ix_outbound_messages_status_id")
+            batch_op.create_index("ix_outbound_messages_channel_status_id", ["channel", "status", "id"])
+
+def downgrade():
+    # Email rows have no phone number to keep, so they go before phone_number is required again
+    op.execute("DELETE FROM outbound_messages WHERE channel <> 'sms'")
+    with op.batch_alter_table("outbound_messages") as batch_op:
+        batch_op.drop_index("ix_outbound_messages_channel_status_id")
+        batch_op.create_index("ix_outbound_messages_status_id", ["status", "id"])
+        batch_op.alter_column("phone_number", existing_type=sa.String(15), nullable=False)
+        batch_op.drop_column("email")
+        batch_op.drop_column("channel")
+    with op.batch_alter_table("user_info") as batch_op:
+        batch_op.drop_column("channels")
+        batch_op.drop_column("email")
+    channel_preference.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,25 @@
+"""member timezone and send hour
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "timezone" not in {column["name"] for column in inspector.get_columns("user_info")}:
+        with op.batch_alter_table("user_info") as batch_op:
+            batch_op.add_column(sa.Column("timezone", sa.String(64), nullable=True))
+            batch_op.add_column(sa.Column("send_hour", sa.SmallInteger, nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("user_info") as batch_op:
+        batch_op.drop_column("send_hour")
+        batch_op.drop_column("timezone")
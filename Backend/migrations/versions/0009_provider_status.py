@@ -0,0 +1,30 @@
+"""provider delivery status on the outbox
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "provider_status" not in {column["name"] for column in inspector.get_columns("outbound_messages")}:
+        with op.batch_alter_table("outbound_messages") as batch_op:
+            batch_op.add_column(sa.Column("provider_status", sa.String(20), nullable=True))
+            batch_op.add_column(sa.Column("provider_error", sa.String(64), nullable=True))
+            batch_op.add_column(sa.Column("provider_status_at", sa.DateTime, nullable=True))
+            # Twilio status callbacks find their row by MessageSid
+            batch_op.create_index("ix_outbound_messages_provider_id", ["provider_id"])
+
+def downgrade():
+    with op.batch_alter_table("outbound_messages") as batch_op:
+        batch_op.drop_index("ix_outbound_messages_provider_id")
+        batch_op.drop_column("provider_status_at")
+        batch_op.drop_column("provider_error")
+        batch_op.drop_column("provider_status")
@@ -0,0 +1,29 @@
+"""login_buckets for the shared login rate limit backend
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "login_buckets" not in inspector.get_table_names():
+        op.create_table(
+            "login_buckets",
+            sa.Column("key", sa.String(300), primary_key=True),
+            sa.Column("tokens", sa.Float, nullable=False),
+            sa.Column("updated_at", sa.Float, nullable=False),
+            sa.Column("allowed", sa.Boolean, nullable=False),
+        )
+        op.create_index("ix_login_buckets_updated_at", "login_buckets", ["updated_at"])
+
+def downgrade():
+    op.drop_index("ix_login_buckets_updated_at", table_name="login_buckets")
+    op.drop_table("login_buckets")
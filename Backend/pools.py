@@ -0,0 +1,77 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+class PoolStats:
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.checkins = 0
+        self.connections_opened = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_total += seconds
+        if seconds > self.wait_max:
+            self.wait_max = seconds
+
+class InstrumentedPoolMixin:
+    """Times every connection request against the pool and counts what its events report."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        event.listen(self, "connect", self._on_connect)
+        event.listen(self, "checkout", self._on_checkout)
+        event.listen(self, "checkin", self._on_checkin)
+        event.listen(self, "invalidate", self._on_invalidate)
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.stats.connections_opened += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.stats.checkouts += 1
+        self.stats.peak_checked_out = max(self.stats.peak_checked_out, self.checkedout())
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.stats.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.stats.invalidations += 1
+
+    def metrics(self) -> dict:
+        stats = self.stats
+        return {
+            "pool_size": self.size(),
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": self.overflow(),
+            "peak_checked_out": stats.peak_checked_out,
+            "checkouts": stats.checkouts,
+            "checkins": stats.checkins,
+            "connections_opened": stats.connections_opened,
+            "invalidations": stats.invalidations,
+            "timeouts": stats.timeouts,
+            "wait_avg_ms": round(stats.wait_total / stats.checkouts * 1000, 3) if stats.checkouts else 0.0,
+            "wait_max_ms": round(stats.wait_max * 1000, 3),
+        }
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
@@ -0,0 +1,40 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+class QueryCounter:
+    """Collects every SQL statement the given engines send while active.
+
+    Meant for tests, e.g. asserting an endpoint's statement count stays flat as rows are added:
+
+        with assert_max_queries(3, async_engine.sync_engine):
+            client.post("/message/write-message?event_type=anniversary", headers=headers)
+    """
+
+    def __init__(self) -> None:
+        self.statements: list = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+@contextmanager
+def count_queries(*engines):
+    counter = QueryCounter()
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", counter._record)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", counter._record)
+
+@contextmanager
+def assert_max_queries(limit: int, *engines):
+    with count_queries(*engines) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(f"  {i}. {statement}" for i, statement in enumerate(counter.statements, 1))
+        raise AssertionError(f"Expected at most {limit} SQL statements, got {counter.count}:\n{statements}")
@@ -0,0 +1,185 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Protocol, Tuple
+from fastapi import HTTPException, Request, status
+from sqlalchemy import case, delete
+from dotenv import load_dotenv
+from tables import Async_Local_Session, LoginBucket
+from func import upsert_insert
+from metrics import request_metrics
+
+load_dotenv()
+LOGIN_RATE_LIMIT = os.getenv("AMS_LOGIN_RATE_LIMIT", "true").lower() in ("1", "true", "yes")
+# memory: per-process buckets; database: one set of buckets shared by every worker and pod
+LOGIN_LIMIT_BACKEND = os.getenv("AMS_LOGIN_LIMIT_BACKEND", "memory")
+# Attempts allowed in a burst, then the sustained rate, per username and per client address
+LOGIN_USERNAME_BURST = float(os.getenv("AMS_LOGIN_USERNAME_BURST", "10"))
+LOGIN_USERNAME_PER_MINUTE = float(os.getenv("AMS_LOGIN_USERNAME_PER_MINUTE", "5"))
+LOGIN_IP_BURST = float(os.getenv("AMS_LOGIN_IP_BURST", "30"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("AMS_LOGIN_IP_PER_MINUTE", "60"))
+# Upper bound on buckets held by the memory backend; the least recently used are dropped first
+LOGIN_LIMIT_MAX_KEYS = int(os.getenv("AMS_LOGIN_LIMIT_MAX_KEYS", "100000"))
+# Only behind a proxy that sets it: the last X-Forwarded-For entry is the address the proxy saw
+TRUST_FORWARDED_FOR = os.getenv("AMS_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+# The database backend deletes buckets that have refilled completely every this many attempts
+PRUNE_EVERY = 1000
+
+logger = logging.getLogger("ams.ratelimit")
+
+@dataclass(frozen=True)
+class BucketLimit:
+    capacity: float
+    per_second: float
+
+    @classmethod
+    def per_minute(cls, burst: float, per_minute: float) -> "BucketLimit":
+        return cls(capacity=max(1.0, burst), per_second=per_minute / 60)
+
+    @property
+    def refill_seconds(self) -> float:
+        # An idle bucket is full again after this long, so it can be forgotten
+        return self.capacity / self.per_second
+
+class BucketStore(Protocol):
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        """Takes one token; returns 0 when one was available, otherwise the seconds until there is."""
+        ...
+
+class MemoryBucketStore:
+    """Token buckets in an LRU of (tokens, updated_at) pairs, bounded at maxsize keys.
+
+    A dropped bucket only comes back full, which is what it would have refilled to anyway unless
+    the address or username was still being throttled.
+    """
+
+    def __init__(self, maxsize: int = LOGIN_LIMIT_MAX_KEYS) -> None:
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.per_second)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / limit.per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class DatabaseBucketStore:
+    """Buckets in the login_buckets table, updated with one INSERT ... ON CONFLICT DO UPDATE per take.
+
+    The refill and the take happen in that single statement, so concurrent attempts from different
+    workers can't both spend the last token.
+    """
+
+    def __init__(self, idle_seconds: float) -> None:
+        self.idle_seconds = idle_seconds
+        self._takes = 0
+
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        async with Async_Local_Session() as db:
+            elapsed = case((LoginBucket.updated_at < now, now - LoginBucket.updated_at), else_=0.0)
+            refilled = case(
+                (LoginBucket.tokens + elapsed * limit.per_second > limit.capacity, limit.capacity),
+                else_=LoginBucket.tokens + elapsed * limit.per_second,
+            )
+            statement = (
+                upsert_insert(db, LoginBucket)
+                .values(key=key, tokens=limit.capacity - 1, updated_at=now, allowed=True)
+                .on_conflict_do_update(
+                    index_elements=[LoginBucket.key],
+                    set_={
+                        # SET expressions all read the row as it was, so refilled is the same in each
+                        "tokens": case((refilled >= 1, refilled - 1), else_=refilled),
+                        "allowed": refilled >= 1,
+                        "updated_at": now,
+                    },
+                )
+                .returning(LoginBucket.tokens, LoginBucket.allowed)
+            )
+            bucket = (await db.execute(statement)).one()
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                await db.execute(delete(LoginBucket).where(LoginBucket.updated_at < now - self.idle_seconds))
+            await db.commit()
+        return 0.0 if bucket.allowed else (1 - bucket.tokens) / limit.per_second
+
+class LoginLimiter:
+    def __init__(self, store: BucketStore, username_limit: BucketLimit, ip_limit: BucketLimit) -> None:
+        self.store = store
+        self.username_limit = username_limit
+        self.ip_limit = ip_limit
+        self.throttled: Dict[str, int] = {"ip": 0, "username": 0}
+
+    async def check(self, username: str, ip: Optional[str]) -> float:
+        """Seconds the caller must wait before trying again, or 0 when the attempt may go ahead."""
+        # The address is checked first, so a spray over many usernames from one host stops there
+        for kind, key, limit in (("ip", ip, self.ip_limit), ("username", (username or "").lower(), self.username_limit)):
+            if not key:
+                continue
+            try:
+                wait = await self.store.take(f"{kind}:{key}", limit, time.time())
+            except Exception:
+                # Fails open: a broken shared backend shouldn't lock every member out
+                logger.exception("Login rate limit backend failed")
+                return 0.0
+            if wait:
+                self.throttled[kind] += 1
+                return wait
+        return 0.0
+
+    def render_metrics(self) -> list:
+        lines = [
+            "# HELP ams_login_throttled_total Login attempts turned away before the password check.",
+            "# TYPE ams_login_throttled_total counter",
+        ]
+        lines.extend(f'ams_login_throttled_total{{key="{kind}"}} {count}' for kind, count in sorted(self.throttled.items()))
+        if isinstance(self.store, MemoryBucketStore):
+            lines.extend([
+                "# HELP ams_login_buckets Login rate limit buckets held in memory.",
+                "# TYPE ams_login_buckets gauge",
+                f"ams_login_buckets {len(self.store)}",
+            ])
+        return lines
+
+def build_login_limiter() -> LoginLimiter:
+    username_limit = BucketLimit.per_minute(LOGIN_USERNAME_BURST, LOGIN_USERNAME_PER_MINUTE)
+    ip_limit = BucketLimit.per_minute(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+    if LOGIN_LIMIT_BACKEND == "database":
+        store = DatabaseBucketStore(idle_seconds=max(username_limit.refill_seconds, ip_limit.refill_seconds))
+    else:
+        store = MemoryBucketStore()
+    return LoginLimiter(store, username_limit, ip_limit)
+
+login_limiter = build_login_limiter()
+request_metrics.register(login_limiter.render_metrics)
+
+def client_ip(request: Request) -> Optional[str]:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else None
+
+async def limit_login(request: Request, username: str):
+    if not LOGIN_RATE_LIMIT:
+        return
+    wait = await login_limiter.check(username, client_ip(request))
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
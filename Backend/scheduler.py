@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from sqlalchemy import select
+from dotenv import load_dotenv
+from tables import Async_Local_Session, User, DeliveryLog
+from schemas import EventType
+from snapshot import Recipient, event_rows, to_recipient, recipient_snapshot
+from templates import template_cache, render_messages
+from dispatch import OutgoingMessage
+from func import delivery_key, enqueue_messages
+from events import connection_manager
+
+load_dotenv()
+# Every uvicorn worker may run the scheduler: member changes reach each worker's heap through the
+# invalidation bus, and the delivery log turns a second enqueue of the same send into a skip
+SCHEDULER_ENABLED = os.getenv("AMS_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+DEFAULT_TIMEZONE = os.getenv("AMS_DEFAULT_TIMEZONE", "UTC")
+DEFAULT_SEND_HOUR = int(os.getenv("AMS_DEFAULT_SEND_HOUR", "9"))
+# Timers due within this many seconds of each other are fired as one enqueue
+SCHEDULER_FIRE_WINDOW = float(os.getenv("AMS_SCHEDULER_FIRE_WINDOW", "1"))
+# A burst of member changes (an import, activate-all) is coalesced into one rebuild
+SCHEDULER_RELOAD_DELAY = float(os.getenv("AMS_SCHEDULER_RELOAD_DELAY", "2"))
+# Sends still due in the log check are looked up this many keys at a time
+LOG_CHECK_CHUNK = 500
+
+logger = logging.getLogger("ams.scheduler")
+
+@dataclass(frozen=True)
+class ScheduledSend:
+    fire_at: datetime
+    event_type: EventType
+    local_date: date
+    recipient: Recipient
+
+    @property
+    def key(self) -> str:
+        return delivery_key(self.event_type.value, self.recipient.label, self.recipient.user_id, self.local_date)
+
+def member_zone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        # Stored names are validated on the way in; this only covers a zone dropped from the tz database
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+def send_time(day: date, zone: ZoneInfo, send_hour: Optional[int]) -> datetime:
+    hour = DEFAULT_SEND_HOUR if send_hour is None else send_hour
+    return datetime.combine(day, time(hour), zone).astimezone(timezone.utc)
+
+def next_utc_midnight(now: datetime) -> datetime:
+    return datetime.combine(now.date() + timedelta(days=1), time(0), timezone.utc)
+
+class SendScheduler:
+    """Fires each member's automatic messages at their local send hour.
+
+    Each UTC day's sends are loaded in one pass into a heap of timers ordered by fire time, and a
+    single task sleeps until the earliest one, so tens of thousands of pending sends cost one
+    sleeping coroutine and O(log n) per timer. Member changes (through the recipient snapshot's
+    invalidation) and restarts rebuild the heap from the database; sends the delivery log already
+    holds are dropped, and ones missed while the process was down go out late the same local day.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[datetime, int, ScheduledSend]] = []
+        self._sequence = itertools.count()
+        self._loaded_until: Optional[datetime] = None
+        self._stale = True
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def next_fire_at(self) -> Optional[datetime]:
+        return self._heap[0][0] if self._heap else None
+
+    def invalidate(self) -> None:
+        self._stale = True
+        if self._wake is not None:
+            self._wake.set()
+
+    def push(self, send: ScheduledSend) -> None:
+        heapq.heappush(self._heap, (send.fire_at, next(self._sequence), send))
+
+    def pop_due(self, now: datetime) -> List[ScheduledSend]:
+        due = []
+        cutoff = now + timedelta(seconds=SCHEDULER_FIRE_WINDOW)
+        while self._heap and self._heap[0][0] <= cutoff:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    async def load(self, start: datetime, end: datetime, catch_up: bool) -> List[ScheduledSend]:
+        """Sends firing before end. With catch_up, ones from before start whose local day is still
+        running are included (after a restart or rebuild); otherwise only those from start on."""
+        sends = []
+        # Local calendar days run up to 14 hours either side of UTC
+        first_day, last_day = start.date() - timedelta(days=1), end.date() + timedelta(days=1)
+        async with Async_Local_Session() as db:
+            day = first_day
+            while day <= last_day:
+                # Sent with no admin in the loop, so only approved members are greeted
+                events = await event_rows(db, day, User.timezone, User.send_hour, active_only=True)
+                for event_type, rows in events.items():
+                    for row, label in rows:
+                        zone = member_zone(row.timezone)
+                        fire_at = send_time(day, zone, row.send_hour)
+                        if fire_at >= end:
+                            continue
+                        if fire_at < start:
+                            if not catch_up or datetime.combine(day + timedelta(days=1), time(0), zone) <= start:
+                                continue
+                        sends.append(ScheduledSend(fire_at, event_type, day, to_recipient(row, label)))
+                day += timedelta(days=1)
+            if catch_up:
+                sends = await self._drop_logged(db, sends, start)
+        return sends
+
+    async def _drop_logged(self, db, sends: List[ScheduledSend], start: datetime) -> List[ScheduledSend]:
+        # Only overdue sends can already be in the log; the rest haven't fired yet
+        overdue = {send.key for send in sends if send.fire_at < start}
+        logged = set()
+        keys = list(overdue)
+        for offset in range(0, len(keys), LOG_CHECK_CHUNK):
+            chunk = keys[offset:offset + LOG_CHECK_CHUNK]
+            logged.update((await db.scalars(select(DeliveryLog.idempotency_key).where(DeliveryLog.idempotency_key.in_(chunk)))).all())
+        return [send for send in sends if send.key not in logged]
+
+    async def rebuild(self, now: datetime) -> None:
+        self._stale = False
+        loaded_until = next_utc_midnight(now)
+        sends = await self.load(now, loaded_until, catch_up=True)
+        self._heap = [(send.fire_at, next(self._sequence), send) for send in sends]
+        heapq.heapify(self._heap)
+        self._loaded_until = loaded_until
+
+    async def extend(self) -> None:
+        # The next UTC day's sends, added once the previous day is fully loaded
+        start = self._loaded_until
+        end = next_utc_midnight(start)
+        for send in await self.load(start, end, catch_up=False):
+            self.push(send)
+        self._loaded_until = end
+
+    async def fire(self, due: List[ScheduledSend]) -> int:
+        groups: Dict[Tuple[EventType, date], List[Recipient]] = defaultdict(list)
+        for send in due:
+            groups[(send.event_type, send.local_date)].append(send.recipient)
+        queued_total = 0
+        async with Async_Local_Session() as db:
+            for (event_type, local_date), recipients in groups.items():
+                templates = await template_cache.load(db, event_type)
+                outgoing = [
+                    OutgoingMessage(
+                        username=recipient.username, phone_number=recipient.phone_number, body=body, user_id=recipient.user_id,
+                        label=recipient.label, email=recipient.email, channels=recipient.channels,
+                    )
+                    for recipient, body in zip(recipients, render_messages(event_type, templates, recipients))
+                ]
+                # The member's local date keys the delivery log, matching a manual send on their day
+                queued = await enqueue_messages(db, outgoing, event_type.value, local_date)
+                if queued:
+                    await connection_manager.publish("delivery.queued", {"event_type": event_type.value, "count": len(queued)})
+                queued_total += len(queued)
+        return queued_total
+
+    async def run(self) -> None:
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                if self._stale:
+                    await asyncio.sleep(SCHEDULER_RELOAD_DELAY)
+                    await self.rebuild(datetime.now(timezone.utc))
+                elif datetime.now(timezone.utc) >= self._loaded_until:
+                    await self.extend()
+                due = self.pop_due(datetime.now(timezone.utc))
+                if due:
+                    await self.fire(due)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Send scheduler pass failed, retrying after a rebuild")
+                self._stale = True
+                continue
+
+            self._wake.clear()
+            if self._stale:
+                continue
+            wake_at = min(filter(None, (self.next_fire_at(), self._loaded_until)))
+            timeout = max(0.0, (wake_at - datetime.now(timezone.utc)).total_seconds())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+send_scheduler = SendScheduler()
+recipient_snapshot.on_invalidate(send_scheduler.invalidate)
@@ -1,13 +1,32 @@
 from datetime import date, datetime
-from typing import List
+from typing import Dict, List
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, EmailStr, field_validator, model_validator
 from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+class ChannelPreference(str, Enum):
+    sms = "sms"
+    email = "email"
+    both = "both"
+
+    @property
+    def channels(self) -> List[str]:
+        return ["sms", "email"] if self == ChannelPreference.both else [self.value]
 
 class OtherDateBase(BaseModel):
     label: str
     date: date
 
+def check_timezone(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return value
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{value}', use an IANA name such as Europe/London")
+    return value
+
 class UserSignUpInfo(BaseModel):
     first_name: str
     last_name: str
@@ -16,12 +35,74 @@ class UserSignUpInfo(BaseModel):
     password: str
     dob:date
     profile_pic: Optional[str] = None
+    email: Optional[EmailStr] = None
+    channels: ChannelPreference = ChannelPreference.sms
+    # Unset means the server defaults (AMS_DEFAULT_TIMEZONE, AMS_DEFAULT_SEND_HOUR)
+    timezone: Optional[str] = None
+    send_hour: Optional[int] = Field(None, ge=0, le=23)
     other_dates: Optional[List[OtherDateBase]] = []  
 
+    _check_timezone = field_validator("timezone")(check_timezone)
+
+    @model_validator(mode="after")
+    def email_channel_needs_address(self):
+        if self.channels != ChannelPreference.sms and not self.email:
+            raise ValueError("An email address is required to receive messages by email")
+        return self
+
+class ContactPreferences(BaseModel):
+    email: Optional[EmailStr] = None
+    channels: ChannelPreference
+
+    @model_validator(mode="after")
+    def email_channel_needs_address(self):
+        if self.channels != ChannelPreference.sms and not self.email:
+            raise ValueError("An email address is required to receive messages by email")
+        return self
+
+class SchedulePreferences(BaseModel):
+    timezone: Optional[str] = None
+    send_hour: Optional[int] = Field(None, ge=0, le=23)
+
+    _check_timezone = field_validator("timezone")(check_timezone)
+
 class StatusEnum(str, Enum):
     pending = "pending"
     active = "active"
 
+class OutboxStatusEnum(str, Enum):
+    pending = "pending"
+    sending = "sending"
+    sent = "sent"
+    failed = "failed"
+
+class FileFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class BulkAction(str, Enum):
+    activate = "activate"
+    reject = "reject"
+
+class BulkMemberAction(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    action: BulkAction
+
+class BulkMemberResult(BaseModel):
+    action: BulkAction
+    processed: List[int]
+    skipped: List[int]
+
+class ImportRowError(BaseModel):
+    row: int
+    username: Optional[str] = None
+    errors: List[str]
+
+class ImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+
 class UserResponse(BaseModel):
     first_name: str
     last_name: str
@@ -29,6 +110,11 @@ class UserResponse(BaseModel):
     username: str
     dob: date
     status: StatusEnum
+    email: Optional[str] = None
+    channels: Optional[ChannelPreference] = None
+    timezone: Optional[str] = None
+    send_hour: Optional[int] = None
+    avatar_etag: Optional[str] = None
    
     model_config = {
         "arbitrary_types_allowed": True,
@@ -43,7 +129,6 @@ class DummyUser(BaseModel):
     password: str = "ade"
     dob: date = date(1999, 12, 1)
     status: StatusEnum = StatusEnum.pending
-    profile_pic: Optional[bytes] = None
     other_dates: Optional[List[OtherDateBase]] = [
         OtherDateBase(label="anniversary", date=date(2018, 10, 19)),
         OtherDateBase(label="graduation", date=date(2022, 6, 5)),
@@ -71,10 +156,59 @@ class EventType(str, Enum):
     anniversary = "anniversary"
     others = "others"
 
+class TemplateCreate(BaseModel):
+    event_type: EventType
+    label: str = ""
+    body: str = Field(min_length=1)
+
+class TemplateUpdate(BaseModel):
+    body: str = Field(min_length=1)
+
+class TemplateInfo(BaseModel):
+    id: int
+    event_type: EventType
+    label: str
+    body: str
+    version: int
+    updated_at: datetime
+
+    model_config = {"from_attributes": True}
+
 class MessagePreview(BaseModel):
     username: str
     message: str
     event_type: EventType
+    delivery_status: Optional[str] = None
+
+class DeliveryLogEntry(BaseModel):
+    id: int
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    event_type: str
+    label: str
+    send_date: date
+    body: str
+    created_at: datetime
+    channel: Optional[str] = None
+    delivery_status: Optional[OutboxStatusEnum] = None
+    attempts: Optional[int] = None
+    sent_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    provider_status: Optional[str] = None
+    provider_error: Optional[str] = None
+    provider_status_at: Optional[datetime] = None
+
+class UpcomingEvent(BaseModel):
+    user_id: int
+    username: str
+    first_name: str
+    last_name: Optional[str] = None
+    date: date
+    years: int
+
+class UpcomingDay(BaseModel):
+    date: date
+    events: Dict[str, List[UpcomingEvent]]
 
 class DatesSchema(BaseModel):
     id: int
@@ -88,4 +222,7 @@ class DatesSchema(BaseModel):
 class CustomMessage(BaseModel):
     username: Optional[str] = None
     event_type: EventType
-    message: str
\ No newline at end of file
+    message: str
+
+class CustomMessageResult(CustomMessage):
+    delivery_status: Optional[str] = None
@@ -0,0 +1,103 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from tables import Async_Local_Session, User, Dates
+from func import birthdays_on, dates_on
+from schemas import EventType, StatusEnum
+from invalidation import invalidation_bus
+
+@dataclass(frozen=True)
+class Recipient:
+    user_id: int
+    username: str
+    first_name: str
+    phone_number: Optional[str]
+    label: Optional[str] = None
+    email: Optional[str] = None
+    channels: str = "sms"
+
+RECIPIENT_COLUMNS = (User.id, User.username, User.first_name, User.phone_number, User.email, User.channels)
+
+def to_recipient(row, label: Optional[str] = None) -> Recipient:
+    return Recipient(
+        user_id=row.id, username=row.username, first_name=row.first_name, phone_number=row.phone_number,
+        label=label, email=row.email, channels=row.channels.value,
+    )
+
+async def event_rows(db: AsyncSession, day: date, *extra_columns, active_only: bool = False) -> Dict[EventType, list]:
+    """(row, label) pairs for every event on day, by event type; rows carry RECIPIENT_COLUMNS plus extra_columns.
+    active_only leaves out members an admin hasn't approved yet."""
+    columns = RECIPIENT_COLUMNS + extra_columns
+    birthdays = birthdays_on(day).with_only_columns(*columns)
+    dates = (
+        dates_on(day)
+        .join(Dates.user)
+        .with_only_columns(*columns, Dates.label)
+        .order_by(Dates.id)
+    )
+    if active_only:
+        birthdays = birthdays.where(User.status == StatusEnum.active)
+        dates = dates.where(User.status == StatusEnum.active)
+    birthdays = (await db.execute(birthdays)).all()
+    dates = (await db.execute(dates)).all()
+    return {
+        EventType.birthday: [(row, None) for row in birthdays],
+        # Only dates labelled "anniversary", as custom-message always selected; the original write-message
+        # greeted every dated event as an anniversary
+        EventType.anniversary: [(row, row.label) for row in dates if row.label == "anniversary"],
+        EventType.others: [(row, row.label) for row in dates if row.label not in ("birthday", "anniversary")],
+    }
+
+async def build_recipients(db: AsyncSession, day: date) -> Dict[EventType, List[Recipient]]:
+    events = await event_rows(db, day)
+    return {event_type: [to_recipient(row, label) for row, label in rows] for event_type, rows in events.items()}
+
+class RecipientSnapshot:
+    """Today's recipients by event type, built once per day and dropped whenever members change."""
+
+    def __init__(self) -> None:
+        self._day: Optional[date] = None
+        self._events: Optional[Dict[EventType, List[Recipient]]] = None
+        self._generation = 0
+        self._listeners: List[Callable[[], None]] = []
+
+    def on_invalidate(self, listener: Callable[[], None]) -> None:
+        # Lets other per-day caches (the send scheduler) follow member changes without touching every route
+        self._listeners.append(listener)
+
+    async def get(self, db: AsyncSession, day: date) -> Dict[EventType, List[Recipient]]:
+        if self._day == day and self._events is not None:
+            return self._events
+        generation = self._generation
+        events = await build_recipients(db, day)
+        # Don't keep a snapshot that an invalidation raced with while it was being built
+        if generation == self._generation:
+            self._day, self._events = day, events
+        return events
+
+    async def refresh(self, day: date) -> None:
+        # Every worker runs its own daily refresh, so there's nothing to announce
+        self.invalidate(announce=False)
+        async with Async_Local_Session() as db:
+            await self.get(db, day)
+
+    def invalidate(self, announce: bool = True) -> None:
+        """Drops the snapshot here and, with announce, in every other worker (a member changed)."""
+        self._generation += 1
+        self._day = None
+        self._events = None
+        for listener in self._listeners:
+            listener()
+        if announce:
+            invalidation_bus.announce("recipients.invalidate")
+
+recipient_snapshot = RecipientSnapshot()
+invalidation_bus.register("recipients.invalidate", lambda data: recipient_snapshot.invalidate(announce=False))
+
+async def refresh_daily(snapshot: RecipientSnapshot = recipient_snapshot):
+    while True:
+        await snapshot.refresh(date.today())
+        tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((tomorrow - datetime.now()).total_seconds() + 1)
@@ -1,9 +1,11 @@
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, Date, DateTime, ForeignKey, Enum
+from sqlalchemy import create_engine, event, Column, Integer, SmallInteger, String, Text, Date, DateTime, Float, Boolean, ForeignKey, Enum, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime
 import os
-from schemas import StatusEnum
+from schemas import StatusEnum, OutboxStatusEnum, ChannelPreference
+from pools import InstrumentedQueuePool, InstrumentedAsyncQueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,28 +15,72 @@ AMS_PASSWORD=os.getenv("AMS_PASSWORD")
 AMS_DB=os.getenv("AMS_DB")
 AMS_HOST=os.getenv("AMS_HOST")
 AMS_PORT = os.getenv("AMS_PORT", "5434")
+AMS_POOL_SIZE = int(os.getenv("AMS_POOL_SIZE", "5"))
+AMS_POOL_MAX_OVERFLOW = int(os.getenv("AMS_POOL_MAX_OVERFLOW", "10"))
+AMS_POOL_TIMEOUT = float(os.getenv("AMS_POOL_TIMEOUT", "30"))
+AMS_POOL_RECYCLE = int(os.getenv("AMS_POOL_RECYCLE", "1800"))
+AMS_POOL_PRE_PING = os.getenv("AMS_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 
-db_url = f"postgresql://{AMS_USER}:{AMS_PASSWORD}@{AMS_HOST}:{AMS_PORT}/{AMS_DB}"
+# AMS_DATABASE_URL / AMS_ASYNC_DATABASE_URL override the Postgres settings, e.g. to point benchmarks at SQLite
+db_url = os.getenv("AMS_DATABASE_URL") or f"postgresql://{AMS_USER}:{AMS_PASSWORD}@{AMS_HOST}:{AMS_PORT}/{AMS_DB}"
+async_db_url = os.getenv("AMS_ASYNC_DATABASE_URL") or f"postgresql+asyncpg://{AMS_USER}:{AMS_PASSWORD}@{AMS_HOST}:{AMS_PORT}/{AMS_DB}"
 
-engine = create_engine(db_url)
+pool_options = {
+    "pool_size": AMS_POOL_SIZE,
+    "max_overflow": AMS_POOL_MAX_OVERFLOW,
+    "pool_timeout": AMS_POOL_TIMEOUT,
+    "pool_recycle": AMS_POOL_RECYCLE,
+    "pool_pre_ping": AMS_POOL_PRE_PING,
+}
+
+engine = create_engine(db_url, poolclass=InstrumentedQueuePool, **pool_options)
 Local_Session = sessionmaker(bind=engine)
+async_engine = create_async_engine(async_db_url, poolclass=InstrumentedAsyncQueuePool, **pool_options)
+# Objects stay usable after commit, since an expired attribute can't be lazily refreshed on an AsyncSession
+Async_Local_Session = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 Base = declarative_base()
 
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are switched on for each connection
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", enable_sqlite_foreign_keys)
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", enable_sqlite_foreign_keys)
+
+def month_day_key(value):
+    # Encodes the calendar position of a date as MMDD (e.g. 1 March -> 301) so "events on day X" can use an index
+    if value is None:
+        return None
+    return value.month * 100 + value.day
+
 class User(Base):
     __tablename__ = "user_info"
     id = Column(Integer, primary_key=True, autoincrement=True)
     first_name = Column(String(256),nullable=False)
     last_name = Column(String(256))
     phone_number = Column(String(15), nullable=False)
+    email = Column(String(256), nullable=True)
+    channels = Column(Enum(ChannelPreference), default=ChannelPreference.sms, nullable=False)
+    # IANA zone name and local hour for automatic messages; NULL falls back to the server defaults
+    timezone = Column(String(64), nullable=True)
+    send_hour = Column(SmallInteger, nullable=True)
     username = Column(String(256), unique=True)
     password = Column(String(256), nullable=False)
     dob = Column(Date)
-    profile_pic = Column(LargeBinary,nullable=True)
+    dob_month_day = Column(SmallInteger, index=True)
+    # The picture itself lives in the avatar store (avatars.py); the row only carries what's needed to serve it
+    avatar_etag = Column(String(64), nullable=True)
+    avatar_content_type = Column(String(50), nullable=True)
     role = Column(String(50), default="user")
     status = Column(Enum(StatusEnum), default=StatusEnum.pending, nullable=False)
     date = Column(DateTime, default=datetime.now)
 
-    other_dates = relationship("Dates", back_populates="user", cascade="all, delete-orphan")
+    # raise_on_sql: a lazy load would be one query per row (and can't run on an AsyncSession), so load it explicitly
+    other_dates = relationship("Dates", back_populates="user", cascade="all, delete-orphan", passive_deletes=True, lazy="raise_on_sql")
 
 class Dates(Base):
     __tablename__ = "other_dates"
@@ -42,15 +88,93 @@ class Dates(Base):
     user_id = Column(Integer, ForeignKey("user_info.id", ondelete="CASCADE"), nullable=False)
     label = Column(String(256), nullable=False)  
     date = Column(Date, nullable=False)
+    month_day = Column(SmallInteger, index=True)
 
-    user = relationship("User", back_populates="other_dates")
+    user = relationship("User", back_populates="other_dates", lazy="raise_on_sql")
 
+class OutboundMessage(Base):
+    __tablename__ = "outbound_messages"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user_info.id", ondelete="SET NULL"), nullable=True)
+    username = Column(String(256))
+    channel = Column(String(10), default="sms", nullable=False)
+    phone_number = Column(String(15), nullable=True)
+    email = Column(String(256), nullable=True)
+    body = Column(Text, nullable=False)
+    event_type = Column(String(50))
+    status = Column(Enum(OutboxStatusEnum), default=OutboxStatusEnum.pending, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    # Twilio's MessageSid (one per message) or SendGrid's X-Message-Id (one per batch); status callbacks match on the former
+    provider_id = Column(String(64), index=True)
+    last_error = Column(Text)
+    # Delivery state reported back by the provider's status callbacks (callbacks.py)
+    provider_status = Column(String(20))
+    provider_error = Column(String(64))
+    provider_status_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+    delivery_log_id = Column(Integer, ForeignKey("delivery_log.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    # Each channel's workers claim their own rows, oldest first
+    __table_args__ = (Index("ix_outbound_messages_channel_status_id", "channel", "status", "id"),)
+
+class DeliveryLog(Base):
+    """Append-only record of every message handed to the outbox, one row per recipient and occurrence."""
+    __tablename__ = "delivery_log"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of (kind, event type, label, user, send date[, custom body]); a repeat send hits the unique index
+    idempotency_key = Column(String(64), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey("user_info.id", ondelete="SET NULL"), nullable=True)
+    username = Column(String(256))
+    event_type = Column(String(50), nullable=False)
+    label = Column(String(256), nullable=False, default="")
+    send_date = Column(Date, nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (Index("ix_delivery_log_occurrence", "user_id", "event_type", "label", "send_date"),)
+
+class MessageTemplate(Base):
+    __tablename__ = "message_templates"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_type = Column(String(50), nullable=False)
+    # "" is the event type's default template; otherwise it matches Dates.label
+    label = Column(String(256), nullable=False, default="")
+    body = Column(Text, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+    __table_args__ = (UniqueConstraint("event_type", "label", name="uq_message_templates_event_type_label"),)
+
+class LoginBucket(Base):
+    """Login token buckets shared by every worker when AMS_LOGIN_LIMIT_BACKEND=database (ratelimit.py)."""
+    __tablename__ = "login_buckets"
+    key = Column(String(300), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # Epoch seconds, so every process computes the refill against the same clock
+    updated_at = Column(Float, nullable=False, index=True)
+    # Whether the last attempt got a token, read back through RETURNING
+    allowed = Column(Boolean, nullable=False)
+
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+def set_dob_month_day(mapper, connection, target):
+    target.dob_month_day = month_day_key(target.dob)
+
+@event.listens_for(Dates, "before_insert")
+@event.listens_for(Dates, "before_update")
+def set_dates_month_day(mapper, connection, target):
+    target.month_day = month_day_key(target.date)
 
-Base.metadata.create_all(engine)
 
 def get_db():
     db = Local_Session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with Async_Local_Session() as db:
+        yield db
@@ -0,0 +1,81 @@
+import string
+from typing import Dict, List, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from tables import MessageTemplate
+from schemas import EventType
+from snapshot import Recipient
+
+TEMPLATE_FIELDS = ("first_name", "username", "label")
+
+# Used when no template is stored for an event type (the messages the platform has always sent)
+DEFAULT_TEMPLATES = {
+    EventType.birthday: "Happy Birthday, {first_name}! 🎉",
+    EventType.anniversary: "Happy Anniversary, {first_name}! 🎉",
+    EventType.others: "Happy {label}, {first_name}! 🎉",
+}
+
+class TemplateError(ValueError):
+    """Raised for a template body that can't be compiled."""
+
+class CompiledTemplate:
+    """A template body parsed once into literal text and recipient fields, so rendering a row is a join."""
+
+    def __init__(self, body: str) -> None:
+        parts = []
+        try:
+            parsed = list(string.Formatter().parse(body))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from e
+        for literal, field, format_spec, conversion in parsed:
+            if literal:
+                parts.append((True, literal))
+            if field is None:
+                continue
+            if field not in TEMPLATE_FIELDS:
+                raise TemplateError(f"Unknown placeholder {{{field}}}, use one of: " + ", ".join(f"{{{name}}}" for name in TEMPLATE_FIELDS))
+            if format_spec or conversion:
+                raise TemplateError(f"Placeholder {{{field}}} can't have a format spec or conversion")
+            parts.append((False, field))
+        self.parts: Tuple[Tuple[bool, str], ...] = tuple(parts)
+
+    def render(self, recipient: Recipient) -> str:
+        return "".join(value if literal else (getattr(recipient, value) or "") for literal, value in self.parts)
+
+default_templates = {event_type: CompiledTemplate(body) for event_type, body in DEFAULT_TEMPLATES.items()}
+
+class TemplateCache:
+    """Compiled templates per (event type, label), recompiled only when the stored row's id or version changes.
+    Each send costs one small version query, so edits made through any worker are picked up straight away."""
+
+    def __init__(self) -> None:
+        self._compiled: Dict[Tuple[str, str], Tuple[Tuple[int, int], CompiledTemplate]] = {}
+
+    async def load(self, db: AsyncSession, event_type: EventType) -> Dict[str, CompiledTemplate]:
+        current = {
+            row.label: (row.id, row.version)
+            for row in (await db.execute(
+                select(MessageTemplate.id, MessageTemplate.label, MessageTemplate.version).where(MessageTemplate.event_type == event_type.value)
+            )).all()
+        }
+        stale = [label for label, key in current.items() if self._compiled.get((event_type.value, label), (None,))[0] != key]
+        if stale:
+            rows = (await db.execute(
+                select(MessageTemplate.id, MessageTemplate.label, MessageTemplate.version, MessageTemplate.body)
+                .where(MessageTemplate.event_type == event_type.value, MessageTemplate.label.in_(stale))
+            )).all()
+            for row in rows:
+                self._compiled[(event_type.value, row.label)] = ((row.id, row.version), CompiledTemplate(row.body))
+        for key in [key for key in self._compiled if key[0] == event_type.value and key[1] not in current]:
+            del self._compiled[key]
+        return {label: self._compiled[(event_type.value, label)][1] for label in current if (event_type.value, label) in self._compiled}
+
+    def invalidate(self, event_type: str, label: str) -> None:
+        self._compiled.pop((event_type, label), None)
+
+template_cache = TemplateCache()
+
+def render_messages(event_type: EventType, templates: Dict[str, CompiledTemplate], recipients: List[Recipient]) -> List[str]:
+    # A label-specific template wins, then the event type's stored default, then the built-in message
+    fallback = templates.get("") or default_templates[event_type]
+    return [templates.get(recipient.label or "", fallback).render(recipient) for recipient in recipients]
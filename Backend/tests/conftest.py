@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+# The app modules read their settings at import time, so the test database is chosen first
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="ams-test-"), "test.db")
+os.environ["AMS_DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ["AMS_ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+os.environ.setdefault("SECRET_KEY", "test-secret-key-that-is-long-enough")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ["AMS_SMS_TRANSPORT"] = "fake"
+os.environ["AMS_EVENTS_BACKEND"] = "memory"
+os.environ["AMS_SEED_DUMMY_USER"] = "true"
+os.environ["AMS_SCHEDULER_ENABLED"] = "false"
+os.environ["AMS_LOGIN_RATE_LIMIT"] = "false"
+os.environ["AMS_BCRYPT_ROUNDS"] = "4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import main
+from snapshot import recipient_snapshot
+import tables
+from schemas import StatusEnum
+
+tables.Base.metadata.create_all(tables.engine)
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    response = client.post("/user/auth-login", data={"username": "ade", "password": "ade"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture
+def clean_members():
+    """Removes every member but the seeded admin, and what was queued for them, after the test."""
+    yield
+    with tables.engine.begin() as conn:
+        conn.execute(tables.Dates.__table__.delete())
+        conn.execute(tables.OutboundMessage.__table__.delete())
+        conn.execute(tables.DeliveryLog.__table__.delete())
+        conn.execute(tables.User.__table__.delete().where(tables.User.username != "ade"))
+    recipient_snapshot.invalidate()
+
+@pytest.fixture
+def add_members(clean_members):
+    """Inserts count members whose birthday, anniversary and one other date all fall today."""
+    created = []
+
+    def add(count: int, status: StatusEnum = StatusEnum.active, prefix: str = "member") -> list:
+        today = date.today()
+        birthday = today.replace(year=1990) if (today.month, today.day) != (2, 29) else date(1992, 2, 29)
+        offset = len(created)
+        usernames = [f"{prefix}{offset + i}" for i in range(count)]
+        with tables.engine.begin() as conn:
+            user_ids = conn.execute(insert(tables.User).returning(tables.User.id), [
+                {
+                    "first_name": username.title(), "last_name": "Test", "phone_number": "+15550100",
+                    "username": username, "password": "x", "dob": birthday,
+                    "dob_month_day": tables.month_day_key(birthday), "status": status,
+                }
+                for username in usernames
+            ]).scalars().all()
+            conn.execute(insert(tables.Dates), [
+                {"user_id": user_id, "label": label, "date": birthday.replace(year=2015), "month_day": tables.month_day_key(birthday)}
+                for user_id in user_ids
+                for label in ("anniversary", "graduation")
+            ])
+        created.extend(user_ids)
+        recipient_snapshot.invalidate()
+        return usernames
+
+    return add
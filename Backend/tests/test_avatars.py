@@ -0,0 +1,46 @@
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from avatars import FilesystemAvatarStore, AvatarError, AvatarTooLarge
+
+def png_header_only(width: int, height: int) -> bytes:
+    """A PNG that claims the given size; the pixel data is never reached if the size is refused."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00")) + chunk(b"IEND", b"")
+
+@pytest.fixture
+def store(tmp_path):
+    return FilesystemAvatarStore(root=str(tmp_path), max_pixels=1000 * 1000)
+
+def test_small_image_is_stored(store):
+    data = io.BytesIO()
+    Image.new("RGB", (300, 200), "red").save(data, format="PNG")
+    etag, content_type = store.store_bytes(1, data.getvalue())
+    assert content_type == "image/png"
+    with Image.open(store.path(1, thumbnail=True)) as thumbnail:
+        assert max(thumbnail.size) == store.thumbnail_size
+
+@pytest.mark.parametrize("width, height", [
+    (2000, 2000),  # over the store's own cap
+    (10000, 10000),  # past Pillow's warning threshold
+    (20000, 20000),  # past Pillow's error threshold
+])
+def test_oversized_dimensions_are_refused_before_decoding(store, width, height):
+    with pytest.raises(AvatarTooLarge):
+        store.store_bytes(1, png_header_only(width, height))
+
+def test_pillow_bomb_limits_are_refused_above_the_store_cap(tmp_path):
+    store = FilesystemAvatarStore(root=str(tmp_path), max_pixels=10 ** 12)
+    for size in (10000, 20000):
+        with pytest.raises(AvatarTooLarge):
+            store.store_bytes(1, png_header_only(size, size))
+
+def test_garbage_is_not_an_image(store):
+    with pytest.raises(AvatarError):
+        store.store_bytes(1, b"not an image")
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+import tables
+from callbacks import StatusBuffer, StatusUpdate
+
+def outbox_rows(count: int) -> list:
+    with tables.engine.begin() as conn:
+        return conn.execute(insert(tables.OutboundMessage).returning(tables.OutboundMessage.id), [
+            {"username": f"cb{i}", "phone_number": "+15550100", "body": "Hello", "channel": "sms"} for i in range(count)
+        ]).scalars().all()
+
+def provider_statuses() -> dict:
+    with tables.engine.connect() as conn:
+        return dict(conn.execute(select(tables.OutboundMessage.id, tables.OutboundMessage.provider_status)).all())
+
+def test_a_rejected_update_does_not_hold_back_the_batch(client, clean_members):
+    ids = outbox_rows(3)
+    buffer = StatusBuffer(max_attempts=3)
+    for outbox_id in ids:
+        buffer.add("sendgrid", "id", str(outbox_id), StatusUpdate("delivered", None, datetime.now()))
+    # Not an outbox id at all, so every write of it fails
+    buffer.add("sendgrid", "id", "not-a-number", StatusUpdate("delivered", None, datetime.now()))
+
+    assert client.portal.call(buffer.flush) == 3
+    assert {outbox_id: provider_statuses()[outbox_id] for outbox_id in ids} == {outbox_id: "delivered" for outbox_id in ids}
+    assert buffer.depth == 1
+
+    client.portal.call(buffer.flush)
+    client.portal.call(buffer.flush)
+    assert buffer.depth == 0
+    assert buffer.dead_lettered == 1
+    assert "ams_callback_dead_lettered_total 1" in buffer.render_metrics()
@@ -0,0 +1,36 @@
+from sqlalchemy import select
+
+import tables
+
+HEADER = "first_name,last_name,phone_number,username,password,dob,other_dates\n"
+
+def import_csv(client, admin_headers, body: str):
+    response = client.post("/user/import-members", headers={**admin_headers, "content-type": "text/csv"}, content=body.encode())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def stored(username: str):
+    with tables.engine.connect() as conn:
+        return conn.execute(select(tables.User.first_name, tables.User.last_name).where(tables.User.username == username)).one_or_none()
+
+def test_quoted_fields_keep_newlines_and_commas(client, admin_headers, clean_members):
+    body = HEADER + (
+        '"Multi\nLine",B,+1,u3,p,1990-01-01,\n'
+        'Ann,"Smith, Jr.",+1,u4,p,1990-01-02,"anniversary=2015-05-01;graduation=2019-06-01"\n'
+        'Plain,Row,+1,u5,p,1990-01-03,\n'
+    )
+    report = import_csv(client, admin_headers, body)
+    assert report == {"imported": 3, "failed": 0, "errors": []}
+    assert tuple(stored("u3")) == ("Multi\nLine", "B")
+    assert tuple(stored("u4")) == ("Ann", "Smith, Jr.")
+
+def test_rows_are_numbered_by_record(client, admin_headers, clean_members):
+    body = HEADER + (
+        '"Two\nLines",B,+1,v1,p,1990-01-01,\n'
+        'Bad,Date,+1,v2,p,not-a-date,\n'
+        '"Never closed,B,+1,v3,p,1990-01-01,\n'
+    )
+    report = import_csv(client, admin_headers, body)
+    assert report["imported"] == 1
+    assert [(error["row"], error["username"]) for error in report["errors"]] == [(2, "v2"), (3, None)]
+    assert stored("v3") is None
@@ -0,0 +1,69 @@
+"""Statement counts for the send and activation routes.
+
+Each route is run against a small and a larger member list under the same limit, so a per-recipient
+query (an N+1) fails here rather than in production. Both caches the routes lean on are emptied
+first, so the limits cover a cold principal lookup and a recipient snapshot rebuild.
+"""
+import pytest
+
+from func import principal_cache
+from querycount import assert_max_queries
+from schemas import StatusEnum
+from snapshot import recipient_snapshot
+from tables import engine, async_engine
+
+ENGINES = (engine, async_engine.sync_engine)
+MEMBER_COUNTS = (5, 60)
+
+def cold_caches():
+    principal_cache.clear()
+    recipient_snapshot.invalidate()
+
+@pytest.mark.parametrize("members", MEMBER_COUNTS)
+@pytest.mark.parametrize("event_type", ["birthday", "anniversary", "others"])
+def test_write_message(client, admin_headers, add_members, members, event_type):
+    add_members(members)
+    cold_caches()
+    # Principal, snapshot birthdays and dates, template versions, then the enqueue's log check and insert
+    with assert_max_queries(6, *ENGINES):
+        response = client.post(f"/message/write-message?event_type={event_type}", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert {message["delivery_status"] for message in response.json()} == {"queued"}
+
+    # A repeat with warm caches is all skips: template versions and the log check
+    with assert_max_queries(2, *ENGINES):
+        response = client.post(f"/message/write-message?event_type={event_type}", headers=admin_headers)
+    assert {message["delivery_status"] for message in response.json()} == {"skipped"}
+
+@pytest.mark.parametrize("members", MEMBER_COUNTS)
+def test_custom_message(client, admin_headers, add_members, members):
+    usernames = add_members(members)
+    cold_caches()
+    with assert_max_queries(5, *ENGINES):
+        response = client.post("/message/custom-message", headers=admin_headers, json={"event_type": "birthday", "message": "Hello"})
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == members
+
+    cold_caches()
+    with assert_max_queries(4, *ENGINES):
+        response = client.post("/message/custom-message", headers=admin_headers, json={"event_type": "others", "username": usernames[0], "message": "Hello"})
+    assert response.status_code == 200, response.text
+
+@pytest.mark.parametrize("members", MEMBER_COUNTS)
+def test_activate(client, admin_headers, add_members, members):
+    usernames = add_members(members, status=StatusEnum.pending)
+    cold_caches()
+    with assert_max_queries(3, *ENGINES):
+        response = client.post(f"/user/new-members/activate?username={usernames[0]}", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "active"
+
+@pytest.mark.parametrize("members", MEMBER_COUNTS)
+def test_activate_all(client, admin_headers, add_members, members):
+    add_members(members, status=StatusEnum.pending)
+    cold_caches()
+    # One UPDATE ... RETURNING, however many members are pending
+    with assert_max_queries(2, *ENGINES):
+        response = client.post("/user/new-members/activate-all", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == members
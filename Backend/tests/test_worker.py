@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+import worker
+
+class NoopDispatcher:
+    async def send_all(self, messages):
+        return []
+
+def test_a_slow_claim_does_not_block_the_event_loop(monkeypatch):
+    def slow_claim(db, batch_size, channel):
+        time.sleep(0.3)  # a lock wait on SELECT ... FOR UPDATE SKIP LOCKED
+        return []
+    monkeypatch.setattr(worker, "claim_batch", slow_claim)
+
+    async def run():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.create_task(ticker())
+        await worker.deliver_batch(NoopDispatcher(), channel="email")
+        ticking.cancel()
+        return max(later - earlier for earlier, later in zip(ticks, ticks[1:]))
+
+    assert asyncio.run(run()) < 0.1
@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, File, UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from tables import User, Dates, get_db
+from fastapi.responses import FileResponse
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from tables import User, Dates, get_async_db
 from typing import List
-from schemas import UserSignUpInfo, UserResponse, Token, TokenResponse, DummyUser, StatusEnum, DatesSchema
-from func import auth_user, auth_current_user, get_password_hash, create_access_token, create_refresh_token, get_user_by_username, role_checker
+from schemas import UserSignUpInfo, UserResponse, Token, TokenResponse, DummyUser, StatusEnum, DatesSchema, FileFormat, BulkMemberAction, BulkMemberResult, BulkAction, ImportReport, ContactPreferences, SchedulePreferences
+from importer import import_members, stream_lines
+from export import stream_export
+from snapshot import recipient_snapshot
+from events import connection_manager
+from hashing import password_hasher, HasherBusy, HasherTimeout
+from ratelimit import limit_login
+from avatars import avatar_store, AvatarError, AvatarTooLarge, THUMBNAIL_CONTENT_TYPE, etag_header, etag_matches
+from func import auth_user, auth_current_user, create_access_token, create_refresh_token, get_user_by_username, role_checker, invalidate_principal, clear_principals, keyset_page, set_next_cursor
 from datetime import datetime,timedelta
 from dotenv import load_dotenv
 from typing import Optional
+import asyncio
+from contextlib import contextmanager
 import os
 
 user_router = APIRouter()
@@ -17,12 +28,28 @@ ALGORITHM = os.getenv("ALGORITHM")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+@contextmanager
+def hasher_errors():
+    # The bcrypt pool sheds load instead of queueing without bound; either way the caller can retry
+    try:
+        yield
+    except HasherBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
+    except HasherTimeout as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+
+member_columns = (User.id, User.first_name, User.last_name, User.phone_number, User.username, User.dob, User.status, User.email, User.channels, User.timezone, User.send_hour, User.avatar_etag)
+dates_columns = (Dates.id, Dates.user_id, Dates.label, Dates.date)
 
 @user_router.post("/register-member", response_model=Token)
-async def add_customer_info(user: UserSignUpInfo, db: Session = Depends(get_db)):
-    if get_user_by_username(db, user.username):
+async def add_customer_info(user: UserSignUpInfo, db: AsyncSession = Depends(get_async_db)):
+    if await get_user_by_username(db, user.username):
         raise HTTPException(status_code=400, detail="Existing username")
-    password_hash = get_password_hash(user.password)
+    with hasher_errors():
+        password_hash = await password_hasher.hash(user.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
     user_details = User(
@@ -32,6 +59,10 @@ async def add_customer_info(user: UserSignUpInfo, db: Session = Depends(get_db))
         username=user.username,
         password=password_hash,
         phone_number=user.phone_number,
+        email=user.email,
+        channels=user.channels,
+        timezone=user.timezone,
+        send_hour=user.send_hour,
         role="user",
         status=StatusEnum.pending.value,
         date=datetime.now()
@@ -41,22 +72,29 @@ async def add_customer_info(user: UserSignUpInfo, db: Session = Depends(get_db))
             user_details.other_dates.append(Dates(label=dates.label, date=dates.date))
 
     db.add(user_details)
-    db.commit()
-    db.refresh(user_details)
+    await db.commit()
+    await db.refresh(user_details)
+    recipient_snapshot.invalidate()
+    await connection_manager.publish("member.pending", {"id": user_details.id, "username": user_details.username, "first_name": user_details.first_name, "last_name": user_details.last_name})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @user_router.post("/register-admin", response_model=Token)
-async def add_admin_profile(text: UserSignUpInfo, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def add_admin_profile(text: UserSignUpInfo, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
-    if get_user_by_username(db, text.username):
+    if await get_user_by_username(db, text.username):
         raise HTTPException(status_code=400, detail="Existing username")
-    password_hash = get_password_hash(text.password)
+    with hasher_errors():
+        password_hash = await password_hasher.hash(text.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": text.username}, expires_delta=access_token_expires)
     admin_profile = User(
         first_name=text.first_name,
         last_name=text.last_name,
         phone_number=text.phone_number,
+        email=text.email,
+        channels=text.channels,
+        timezone=text.timezone,
+        send_hour=text.send_hour,
         dob=text.dob,
         username=text.username,
         password=password_hash,
@@ -64,18 +102,39 @@ async def add_admin_profile(text: UserSignUpInfo, db: Session = Depends(get_db),
         status=StatusEnum.active.value,
         date=datetime.now()
     )
-    if hasattr(user, "other_dates") and user.other_dates:
-        for dates in user.other_dates:
+    if hasattr(text, "other_dates") and text.other_dates:
+        for dates in text.other_dates:
             admin_profile.other_dates.append(Dates(label=dates.label, date=dates.date))
 
     db.add(admin_profile)
-    db.commit()
-    db.refresh(admin_profile)
+    await db.commit()
+    await db.refresh(admin_profile)
+    recipient_snapshot.invalidate()
     return {"access_token": access_token, "token_type": "bearer"}
 
+@user_router.post("/import-members", response_model=ImportReport)
+async def import_member_file(
+    request: Request,
+    file_format: Optional[FileFormat] = Query(None, alias="format"),
+    activate: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
+    await role_checker(required_role="admin", user=user)
+    if file_format is None:
+        file_format = FileFormat.csv if "csv" in request.headers.get("content-type", "") else FileFormat.ndjson
+    member_status = StatusEnum.active if activate else StatusEnum.pending
+    report = await import_members(db, stream_lines(request.stream()), file_format, member_status)
+    recipient_snapshot.invalidate()
+    await connection_manager.publish("members.imported", {"imported": report.imported, "failed": report.failed, "status": member_status.value})
+    return report
+
 @user_router.post("/auth-login", response_model=TokenResponse)
-async def sign_in(user: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user_auth = await auth_user(db, user.username, user.password)
+async def sign_in(request: Request, user: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    # Throttled attempts are turned away here, before they cost a user lookup and a bcrypt verify
+    await limit_login(request, user.username)
+    with hasher_errors():
+        user_auth = await auth_user(db, user.username, user.password)
     if not user_auth:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -85,12 +144,12 @@ async def sign_in(user: OAuth2PasswordRequestForm = Depends(), db: Session = Dep
     return TokenResponse(access_token=access_token, refresh_token=refresh_token, expires_in=ACCESS_TOKEN_EXPIRE_MINUTES)
 
 @user_router.post("/new-members/activate", response_model=UserResponse)
-async def activate_user(user_id: Optional[int] = None, username: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def activate_user(user_id: Optional[int] = None, username: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if user_id:
-        user_to_activate = db.query(User).filter(User.id == user_id).first()
+        user_to_activate = await db.scalar(select(User).where(User.id == user_id))
     elif username:
-        user_to_activate = db.query(User).filter(User.username == username).first()
+        user_to_activate = await db.scalar(select(User).where(User.username == username))
     else:
         raise HTTPException(status_code=400, detail="Provide either user_id or username")
         
@@ -101,46 +160,34 @@ async def activate_user(user_id: Optional[int] = None, username: Optional[str] =
         raise HTTPException(status_code=400, detail="User is not pending")
 
     user_to_activate.status = "active"
-    db.commit()
-    db.refresh(user_to_activate)
-
-    for date_entry in user_to_activate.other_dates:
-            if date_entry.id is None: 
-                date_entry.user_id = user_to_activate.id 
-                db.add(date_entry)
-    db.commit()
+    await db.commit()
+    recipient_snapshot.invalidate()
     return user_to_activate
 
 @user_router.post("/new-members/activate-all", response_model=List[UserResponse])
-async def activate_all_pending_users(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def activate_all_pending_users(db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
-    activate_members = db.query(User).filter(User.status == StatusEnum.pending.value).all()
+    activate_members = (await db.execute(
+        update(User)
+        .where(User.status == StatusEnum.pending.value)
+        .values(status=StatusEnum.active.value)
+        .returning(*member_columns)
+        .execution_options(synchronize_session=False)
+    )).all()
     if not activate_members:
         raise HTTPException(status_code=404, detail="No pending users found")
-    
-    for current_status in activate_members:
-        current_status.status = StatusEnum.active.value
-    db.commit()
-
-    for user_obj in activate_members:
-        for date_entry in user_obj.other_dates:
-            if date_entry.id is None:  
-                date_entry.user_id = user_obj.id
-                db.add(date_entry)
-    db.commit()
-
-    for current_status in activate_members:
-        db.refresh(current_status)
+    await db.commit()
+    recipient_snapshot.invalidate()
 
     return activate_members
 
 @user_router.post("/new-members/reject")
-async def reject_user(user_id: Optional[int] = None, username: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def reject_user(user_id: Optional[int] = None, username: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if user_id:
-        reject_user = db.query(User).filter(User.id == user_id).first()
+        reject_user = await db.scalar(select(User).where(User.id == user_id))
     elif username:
-        reject_user = db.query(User).filter(User.username == username).first()
+        reject_user = await db.scalar(select(User).where(User.username == username))
     else:
         raise HTTPException(status_code=400, detail="Provide either user_id or username")
 
@@ -150,54 +197,116 @@ async def reject_user(user_id: Optional[int] = None, username: Optional[str] = N
     if reject_user.status != StatusEnum.pending.value:
         raise HTTPException(status_code=400, detail="User is not pending")
 
-    db.delete(reject_user)
-    db.commit()
+    await db.delete(reject_user)
+    await db.commit()
+    if reject_user.avatar_etag:
+        await asyncio.to_thread(avatar_store.delete, reject_user.id)
+    invalidate_principal(reject_user.username)
+    recipient_snapshot.invalidate()
     return {"detail": "User rejected and deleted successfully"}
 
 @user_router.post("/admin-members/reject-all")
-async def reject_all_pending_users(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def reject_all_pending_users(db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
-    reject_all_users = db.query(User).filter(User.status == StatusEnum.pending.value).all()
+    # Their other_dates rows go with them through the ON DELETE CASCADE foreign key
+    reject_all_users = (await db.execute(
+        delete(User)
+        .where(User.status == StatusEnum.pending.value)
+        .returning(User.id, User.username, User.avatar_etag)
+        .execution_options(synchronize_session=False)
+    )).all()
 
     if not reject_all_users:
         raise HTTPException(status_code=404, detail="No pending users found")
-    
-    for user_rej in reject_all_users:
-        db.delete(user_rej)
 
-    db.commit()
+    await db.commit()
+    await asyncio.to_thread(avatar_store.delete_many, [row.id for row in reject_all_users if row.avatar_etag])
+    invalidate_principal(*(row.username for row in reject_all_users))
+    recipient_snapshot.invalidate()
     return  {"detail": "All pending users have been rejected and deleted successfully"}
 
+@user_router.post("/new-members/bulk", response_model=BulkMemberResult)
+async def bulk_update_pending_users(bulk_action: BulkMemberAction, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    await role_checker(required_role="admin", user=user)
+    requested_ids = set(bulk_action.user_ids)
+    selected = (User.id.in_(requested_ids), User.status == StatusEnum.pending.value)
+
+    if bulk_action.action == BulkAction.activate:
+        processed = (await db.execute(
+            update(User).where(*selected).values(status=StatusEnum.active.value)
+            .returning(User.id, User.username).execution_options(synchronize_session=False)
+        )).all()
+    else:
+        processed = (await db.execute(
+            delete(User).where(*selected)
+            .returning(User.id, User.username, User.avatar_etag).execution_options(synchronize_session=False)
+        )).all()
+    await db.commit()
+
+    if bulk_action.action == BulkAction.reject:
+        await asyncio.to_thread(avatar_store.delete_many, [row.id for row in processed if row.avatar_etag])
+        invalidate_principal(*(row.username for row in processed))
+    recipient_snapshot.invalidate()
+
+    processed_ids = sorted(row.id for row in processed)
+    return BulkMemberResult(
+        action=bulk_action.action,
+        processed=processed_ids,
+        skipped=sorted(requested_ids.difference(processed_ids)),
+    )
+
 @user_router.get("/view-dates-table", response_model=List[DatesSchema])
-async def view_dates_table(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def view_dates_table(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: Optional[FileFormat] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
     await role_checker(required_role="admin", user=user)
-    view_dates_table = db.query(Dates).all()
+    statement = select(*dates_columns)
+    if export:
+        return stream_export(statement.order_by(Dates.id), export, "dates")
+    view_dates_table = (await db.execute(keyset_page(statement, Dates.id, after_id, limit))).all()
+    set_next_cursor(response, view_dates_table, limit)
     return view_dates_table
 
 @user_router.get("/query-dates-table/{user_id}", response_model=List[DatesSchema])
-async def query_dates_table(user_id: int, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def query_dates_table(user_id: int, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if not user_id:
         raise HTTPException(status_code=404, detail="Enter a User ID")
     
-    dates = db.query(Dates).filter(Dates.user_id == user_id).all()
+    dates = (await db.scalars(select(Dates).where(Dates.user_id == user_id))).all()
     if not dates:
         raise HTTPException(status_code=404, detail="No event(s) on this date for this User ID")
     return dates
 
 @user_router.get("/retrieve-all-admin-members", response_model=List[UserResponse])
-async def retrieve_all_admin_members(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def retrieve_all_admin_members(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: Optional[FileFormat] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
     await role_checker(required_role="admin", user=user)
-    admin_members_list = db.query(User).filter(User.role=="admin").all()
+    statement = select(*member_columns).where(User.role=="admin")
+    if export:
+        return stream_export(statement.order_by(User.id), export, "admin-members")
+    admin_members_list = (await db.execute(keyset_page(statement, User.id, after_id, limit))).all()
+    set_next_cursor(response, admin_members_list, limit)
     return admin_members_list
 
 @user_router.get("/retrieve-admin-member/{user}", response_model=UserResponse)
-async def retrieve_admin_member(user_id: Optional[int] = None, username: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def retrieve_admin_member(user_id: Optional[int] = None, username: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if user_id:
-        admin_member = db.query(User).filter(User.id == user_id).first()
+        admin_member = await db.scalar(select(User).where(User.id == user_id))
     elif username:
-        admin_member = db.query(User).filter(User.username == username).first()
+        admin_member = await db.scalar(select(User).where(User.username == username))
     else:
         raise HTTPException(status_code=404, detail="Provide either user_id or username")
 
@@ -211,7 +320,7 @@ async def update_members_role(
     user_id: Optional[int] = None,
     username: Optional[str] = None,
     user_role: str = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(auth_current_user)
 ):
     await role_checker(required_role="admin", user=user)
@@ -220,9 +329,9 @@ async def update_members_role(
         raise HTTPException(status_code=404, detail="Provide either user_id or username")
 
     if user_id:
-        user_query = db.query(User).filter(User.id == user_id).first()
+        user_query = await db.scalar(select(User).where(User.id == user_id))
     elif username:
-        user_query = db.query(User).filter(User.username == username).first()
+        user_query = await db.scalar(select(User).where(User.username == username))
 
     if not user_query:
         raise HTTPException(status_code=404, detail="User not found")
@@ -237,24 +346,36 @@ async def update_members_role(
         raise HTTPException(status_code=404, detail="Invalid role: must be 'admin' or 'user'")
 
     user_query.role = user_role
-    db.commit()
-    db.refresh(user_query)
+    await db.commit()
+    await db.refresh(user_query)
+    invalidate_principal(user_query.username)
 
     return user_query
 
 @user_router.get("/retrieve-members-details", response_model=List[UserResponse])
-async def retrieve_customer_details(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def retrieve_customer_details(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: Optional[FileFormat] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
     await role_checker(required_role="admin", user=user)
-    customer_details_list = db.query(User).filter(User.role == "user", User.status == "active").all()
+    statement = select(*member_columns).where(User.role == "user", User.status == "active")
+    if export:
+        return stream_export(statement.order_by(User.id), export, "members")
+    customer_details_list = (await db.execute(keyset_page(statement, User.id, after_id, limit))).all()
+    set_next_cursor(response, customer_details_list, limit)
     return customer_details_list
 
 @user_router.get("/retrieve-specific-member-details", response_model=UserResponse)
-async def retrieve_specific_customer_details(user_id: Optional[int] = None, username: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def retrieve_specific_customer_details(user_id: Optional[int] = None, username: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if user_id:
-        user_query = db.query(User).filter(User.id == user_id, User.status == "active").first()
+        user_query = await db.scalar(select(User).where(User.id == user_id, User.status == "active"))
     elif username:
-        user_query = db.query(User).filter(User.username == username, User.status == "active").first()
+        user_query = await db.scalar(select(User).where(User.username == username, User.status == "active"))
     else:
         raise HTTPException(status_code=400, detail="Provide either user_id or username")
 
@@ -264,37 +385,122 @@ async def retrieve_specific_customer_details(user_id: Optional[int] = None, user
     return user_query
 
 @user_router.get("/retrieve-pending-members", response_model=List[UserResponse])
-async def retrieve_pending_members(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def retrieve_pending_members(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: Optional[FileFormat] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(auth_current_user)
+):
     await role_checker(required_role="admin", user=user)
-    pending_member_query = db.query(User).filter(User.status == StatusEnum.pending.value).all()
-    if not pending_member_query:
+    statement = select(*member_columns).where(User.status == StatusEnum.pending.value)
+    if export:
+        return stream_export(statement.order_by(User.id), export, "pending-members")
+    pending_member_query = (await db.execute(keyset_page(statement, User.id, after_id, limit))).all()
+    if not pending_member_query and after_id is None:
         raise HTTPException(status_code=404, detail="No pending users")
+    set_next_cursor(response, pending_member_query, limit)
     return pending_member_query
 
 @user_router.delete("/delete-a-member")
-async def delete_member(user_id: Optional[int] = None, username: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def delete_member(user_id: Optional[int] = None, username: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     if user_id:
-        delete_user_query = db.query(User).filter(User.id == user_id).first()
+        delete_user_query = await db.scalar(select(User).where(User.id == user_id))
     elif username:
-       delete_user_query = db.query(User).filter(User.username == username).first()
+       delete_user_query = await db.scalar(select(User).where(User.username == username))
     else:
         raise HTTPException(status_code=400, detail="Provide either user_id or username")
     
     if not delete_user_query:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db.delete(delete_user_query)
-    db.commit()
+    await db.delete(delete_user_query)
+    await db.commit()
+    if delete_user_query.avatar_etag:
+        await asyncio.to_thread(avatar_store.delete, delete_user_query.id)
+    invalidate_principal(delete_user_query.username)
+    recipient_snapshot.invalidate()
     return {"detail": "Member has been deleted"}
 
 @user_router.delete("/delete-all-members")
-async def delete_all_members(db: Session = Depends(get_db), user: User = Depends(auth_current_user)):
+async def delete_all_members(db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
     await role_checker(required_role="admin", user=user)
     
-    all_users = db.query(User).all()
-    for users in all_users:
-        db.delete(users) 
-
-    db.commit()
-    return {"detail": "All members have been deleted :("}
\ No newline at end of file
+    await db.execute(delete(User).execution_options(synchronize_session=False))
+    await db.commit()
+    await asyncio.to_thread(avatar_store.clear)
+    clear_principals()
+    recipient_snapshot.invalidate()
+    return {"detail": "All members have been deleted :("}
+
+async def profile_owner(db: AsyncSession, user: User, user_id: Optional[int]):
+    # Members manage their own profile; admins can manage anyone's by passing user_id
+    if user_id is None or user_id == user.id:
+        return user.id, user.username
+    await role_checker(required_role="admin", user=user)
+    owner = (await db.execute(select(User.id, User.username).where(User.id == user_id))).first()
+    if not owner:
+        raise HTTPException(status_code=404, detail="User not found")
+    return owner.id, owner.username
+
+@user_router.put("/contact-preferences", response_model=ContactPreferences)
+async def update_contact_preferences(preferences: ContactPreferences, user_id: Optional[int] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    owner_id, owner_username = await profile_owner(db, user, user_id)
+    await db.execute(update(User).where(User.id == owner_id).values(email=preferences.email, channels=preferences.channels))
+    await db.commit()
+    invalidate_principal(owner_username)
+    recipient_snapshot.invalidate()
+    return preferences
+
+@user_router.put("/schedule-preferences", response_model=SchedulePreferences)
+async def update_schedule_preferences(preferences: SchedulePreferences, user_id: Optional[int] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    owner_id, owner_username = await profile_owner(db, user, user_id)
+    await db.execute(update(User).where(User.id == owner_id).values(timezone=preferences.timezone, send_hour=preferences.send_hour))
+    await db.commit()
+    invalidate_principal(owner_username)
+    # Also reschedules today's automatic messages for the new local time
+    recipient_snapshot.invalidate()
+    return preferences
+
+@user_router.put("/profile-pic")
+async def upload_profile_pic(request: Request, user_id: Optional[int] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    owner_id, owner_username = await profile_owner(db, user, user_id)
+    # The raw request body is streamed to disk, so a large upload is never held in memory
+    try:
+        etag, content_type = await avatar_store.save(owner_id, request.stream())
+    except AvatarTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except AvatarError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await db.execute(update(User).where(User.id == owner_id).values(avatar_etag=etag, avatar_content_type=content_type))
+    await db.commit()
+    invalidate_principal(owner_username)
+    return {"detail": "Profile picture updated", "etag": etag}
+
+@user_router.get("/profile-pic/{user_id}")
+async def download_profile_pic(user_id: int, request: Request, thumbnail: bool = False, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    avatar = (await db.execute(select(User.avatar_etag, User.avatar_content_type).where(User.id == user_id))).first()
+    if not avatar or not avatar.avatar_etag:
+        raise HTTPException(status_code=404, detail="No profile picture for this user")
+
+    etag = etag_header(avatar.avatar_etag, thumbnail)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = avatar_store.path(user_id, thumbnail)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No profile picture for this user")
+    return FileResponse(path, media_type=THUMBNAIL_CONTENT_TYPE if thumbnail else avatar.avatar_content_type, headers=headers)
+
+@user_router.delete("/profile-pic")
+async def delete_profile_pic(user_id: Optional[int] = None, db: AsyncSession = Depends(get_async_db), user: User = Depends(auth_current_user)):
+    owner_id, owner_username = await profile_owner(db, user, user_id)
+    await db.execute(update(User).where(User.id == owner_id).values(avatar_etag=None, avatar_content_type=None))
+    await db.commit()
+    await asyncio.to_thread(avatar_store.delete, owner_id)
+    invalidate_principal(owner_username)
+    return {"detail": "Profile picture deleted"}
@@ -0,0 +1,91 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from tables import Local_Session, OutboundMessage
+from schemas import OutboxStatusEnum
+from dispatch import Dispatcher, OutgoingMessage, EMAIL_BATCH_SIZE, EMAIL_CONCURRENCY, build_dispatchers
+from broker import notify
+
+load_dotenv()
+OUTBOX_BATCH_SIZE = int(os.getenv("AMS_OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("AMS_OUTBOX_POLL_INTERVAL", "2"))
+# A row stuck in "sending" longer than this belongs to a worker that died mid-batch and is claimed again
+OUTBOX_LEASE_SECONDS = int(os.getenv("AMS_OUTBOX_LEASE_SECONDS", "300"))
+# Channels this worker delivers; e.g. "sms" for a deployment without SendGrid
+WORKER_CHANNELS = [channel.strip() for channel in os.getenv("AMS_WORKER_CHANNELS", "sms,email").split(",") if channel.strip()]
+# An email claim fills every concurrent SendGrid call with a full batch
+CHANNEL_BATCH_SIZES = {"sms": OUTBOX_BATCH_SIZE, "email": EMAIL_BATCH_SIZE * EMAIL_CONCURRENCY}
+
+def claim_batch(db: Session, batch_size: int = OUTBOX_BATCH_SIZE, channel: str = "sms"):
+    now = datetime.now()
+    stale = now - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    rows = (
+        db.query(OutboundMessage)
+        .filter(OutboundMessage.channel == channel)
+        .filter(or_(
+            OutboundMessage.status == OutboxStatusEnum.pending,
+            and_(OutboundMessage.status == OutboxStatusEnum.sending, OutboundMessage.claimed_at < stale),
+        ))
+        .order_by(OutboundMessage.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed = []
+    for row in rows:
+        row.status = OutboxStatusEnum.sending
+        row.claimed_at = now
+        row.attempts += 1
+        claimed.append((row.id, OutgoingMessage(
+            username=row.username, phone_number=row.phone_number, body=row.body, user_id=row.user_id,
+            email=row.email, channels=row.channel, outbox_id=row.id,
+        )))
+    # Committing releases the row locks; the "sending" status keeps other workers off these rows
+    db.commit()
+    return claimed
+
+def record_results(db: Session, claimed: list, results: list):
+    now = datetime.now()
+    updates = []
+    for (outbox_id, _), result in zip(claimed, results):
+        if result.status == "sent":
+            updates.append({"id": outbox_id, "status": OutboxStatusEnum.sent, "provider_id": result.provider_id, "sent_at": now, "last_error": None})
+        else:
+            updates.append({"id": outbox_id, "status": OutboxStatusEnum.failed, "provider_id": None, "sent_at": None, "last_error": result.error})
+    # Bulk UPDATE by primary key, executed as a single executemany
+    db.execute(update(OutboundMessage), updates)
+    sent = sum(1 for result in results if result.status == "sent")
+    # Delivered to dashboards through LISTEN/NOTIFY when this transaction commits
+    notify(db, "delivery.progress", {"sent": sent, "failed": len(results) - sent})
+    db.commit()
+
+async def deliver_batch(dispatcher: Dispatcher, batch_size: int = OUTBOX_BATCH_SIZE, channel: str = "sms") -> int:
+    # The claim and the result write run in a thread, so a slow lock wait or commit on one channel
+    # never stalls the other channel's sends on the event loop
+    db = Local_Session()
+    try:
+        claimed = await asyncio.to_thread(claim_batch, db, batch_size, channel)
+        if not claimed:
+            return 0
+        results = await dispatcher.send_all([message for _, message in claimed])
+        await asyncio.to_thread(record_results, db, claimed, results)
+        return len(claimed)
+    finally:
+        await asyncio.to_thread(db.close)
+
+async def run_worker():
+    dispatchers = build_dispatchers(WORKER_CHANNELS)
+    print(f"Outbox worker started (channels {', '.join(WORKER_CHANNELS)})")
+    while True:
+        # Channels are delivered side by side so a slow SMS batch doesn't hold up email, or the reverse
+        delivered = await asyncio.gather(*(
+            deliver_batch(dispatcher, CHANNEL_BATCH_SIZES[channel], channel) for channel, dispatcher in dispatchers.items()
+        ))
+        if not any(delivered):
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())